@@ -0,0 +1,301 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013-2015 Adobe Systems Incorporated. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+#
+# Benchmark the panelTools operations (what installPanels.py runs) on
+# generated panel trees.
+#
+# Synthetic panels (a mix of PNG, GIF, JS, CSS, HTML and locale files,
+# plus a .psd that's ignored) are written to a temporary folder, and the
+# install location, Targets folder and caches all live there too, so this
+# runs anywhere, Photoshop or not.
+#
+# Each operation is timed "cold" (a fresh PanelConfig, no manifest or build
+# caches, nothing installed yet) and then "warm" (the same config and
+# caches, with the previous run's results left in place), --repeat times
+# each.  The OS file cache isn't flushed, so cold is cold for this code,
+# not for the disk.
+#
+# Results are written as JSON (--output), and --compare prints how they
+# differ from an earlier results file, e.g. one saved before a change:
+#
+#   python bench/benchPanels.py --output before.json
+#   (change things)
+#   python bench/benchPanels.py --compare before.json
+#
+# Options:
+#     --panels N                Number of panels to generate
+#     --files N                 Files in each panel
+#     --ops OPS                 Comma separated operations to time (default: all)
+#     --repeat N                Times each operation is run, cold and warm
+#  -j,--jobs N                  Panels worked on at once (as installPanels.py -j)
+#     --seed N                  Seed for the generated trees
+#     --keep                    Leave the temporary folder for a look afterwards
+#
+
+import os, sys, argparse, contextlib, io, json, platform, random, shutil, statistics
+import subprocess, tempfile, time, zlib, struct
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+import panelTools
+from panelTools import Panel, PanelConfig, forEachPanel
+
+operations = ('copy', 'sync', 'zip', 'extract', 'erase', 'list', 'check')
+
+#
+# Synthetic panel sources
+#
+
+# A valid (if noisy) PNG of roughly the given size; the pixel data is
+# random, so like real images it doesn't deflate much
+def pngData( rng, size ):
+    def chunk( kind, data ):
+        return struct.pack( ">I", len(data) ) + kind + data + struct.pack( ">I", zlib.crc32( kind + data ) )
+    width = max( 1, int( (size / 3) ** 0.5 ) )
+    rows = b"".join( b"\0" + rng.randbytes( width * 3 ) for y in range( width ) )
+    return (b"\x89PNG\r\n\x1a\n" + chunk( b"IHDR", struct.pack( ">IIBBBBB", width, width, 8, 2, 0, 0, 0 ) )
+            + chunk( b"IDAT", zlib.compress( rows, 1 ) ) + chunk( b"IEND", b"" ))
+
+def gifData( rng, size ):
+    return b"GIF89a" + struct.pack( "<HH", 16, 16 ) + rng.randbytes( max( 0, size - 10 ) )
+
+# Script-like text, which (like real sources) compresses well
+def textData( rng, size, words ):
+    text = []
+    length = 0
+    while length < size:
+        line = "    " + " ".join( rng.choice( words ) for i in range( rng.randint( 3, 12 ) ) ) + ";\n"
+        text.append( line )
+        length += len(line)
+    return "".join( text ).encode( 'utf-8' )
+
+jsWords = ["var", "function", "return", "if", "else", "this", "panel", "layer", "csInterface", "=", "(", ")",
+           "{", "}", "evalScript", "document", "callback", "null", "true", "false", "JSON.parse", "event"]
+
+# (relative folder, extension, share of the files, typical size in bytes)
+fileMix = [("img", ".png", 0.30, 12000),
+           ("img/icons", ".png", 0.10, 2000),
+           ("img", ".gif", 0.05, 4000),
+           ("js", ".js", 0.25, 6000),
+           ("js/lib", ".js", 0.10, 40000),
+           ("css", ".css", 0.08, 3000),
+           ("locale", ".json", 0.07, 800),
+           ("", ".html", 0.05, 2500)]
+
+manifestTemplate = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<ExtensionManifest ExtensionBundleId="com.bench.panel%(index)d" ExtensionBundleName="Bench Panel %(index)d" ExtensionBundleVersion="1.0.%(index)d" Version="9.0">
+  <ExtensionList>
+    <Extension Id="com.bench.panel%(index)d.extension" Version="1.0.%(index)d"/>
+  </ExtensionList>
+  <ExecutionEnvironment>
+    <HostList>
+      <Host Name="PHXS" Version="[15.0,94.9]"/>
+    </HostList>
+  </ExecutionEnvironment>
+  <DispatchInfoList>
+    <Extension Id="com.bench.panel%(index)d.extension">
+      <DispatchInfo>
+        <Resources>
+          <MainPath>./index.html</MainPath>
+          <ScriptPath>./host/main.jsx</ScriptPath>
+        </Resources>
+      </DispatchInfo>
+    </Extension>
+  </DispatchInfoList>
+</ExtensionManifest>
+"""
+
+def writeFile( path, data ):
+    os.makedirs( os.path.dirname( path ), exist_ok=True )
+    with open( path, 'wb' ) as f:
+        f.write( data )
+
+# Write panelCount panels of about filesPerPanel files each into srcFolder
+def makePanels( srcFolder, panelCount, filesPerPanel, seed ):
+    rng = random.Random( seed )
+    for index in range( panelCount ):
+        panelFolder = os.path.join( srcFolder, "panel%d" % index )
+        writeFile( os.path.join( panelFolder, "CSXS", "manifest.xml" ), (manifestTemplate % {'index': index}).encode() )
+        writeFile( os.path.join( panelFolder, "index.html" ), textData( rng, 2000, jsWords ) )
+        writeFile( os.path.join( panelFolder, "host", "main.jsx" ), textData( rng, 8000, jsWords ) )
+        writeFile( os.path.join( panelFolder, "icons", "PanelIcon.psd" ), rng.randbytes( 200000 ) )
+        for fileIndex in range( max( 0, filesPerPanel - 4 ) ):
+            folder, extension, share, typicalSize = rng.choices( fileMix, [m[2] for m in fileMix] )[0]
+            size = int( rng.lognormvariate( 0, 0.8 ) * typicalSize )
+            if extension == ".png":
+                data = pngData( rng, size )
+            elif extension == ".gif":
+                data = gifData( rng, size )
+            else:
+                data = textData( rng, size, jsWords )
+            writeFile( os.path.join( panelFolder, folder, "file%d%s" % (fileIndex, extension) ), data )
+
+#
+# Running the operations
+#
+
+class Bench:
+    def __init__(self, workFolder, jobs):
+        self.srcFolder = os.path.join( workFolder, "src" )
+        self.destFolder = os.path.join( workFolder, "extensions" )
+        self.targetFolder = os.path.join( workFolder, "Targets" )
+        self.jobs = jobs
+        self.config = None
+
+    # Forget everything: caches, archives and installed panels
+    def reset(self):
+        for folder in (self.destFolder, self.destFolder + ".deploy", self.targetFolder,
+                       os.path.join( os.path.dirname( self.destFolder ), "cache" )):
+            if os.path.lexists( folder ):
+                panelTools.removePath( folder )
+        self.newConfig()
+
+    def newConfig(self):
+        self.config = PanelConfig( self.srcFolder, self.destFolder, jobs=self.jobs, targetFolder=self.targetFolder )
+
+    def panels(self):
+        return panelTools.discoverPanels( self.config )
+
+    # What has to be in place (untimed) before an operation can run
+    def prepare(self, op):
+        if op in ('sync', 'erase', 'list'):
+            panels = self.panels()
+            if not all( os.path.isdir( p.destPath() ) for p in panels ):
+                with contextlib.redirect_stdout( io.StringIO() ):
+                    forEachPanel( Panel.copyPanel, panels, self.config )
+        if op == 'extract' and not os.path.isdir( self.targetFolder ):
+            with contextlib.redirect_stdout( io.StringIO() ):
+                forEachPanel( Panel.zipPanel, self.panels(), self.config )
+            self.config.getBuildCache().save()
+
+    def run(self, op):
+        config = self.config
+        if op == 'copy':
+            panelTools.clearExtensionCache( config )
+            forEachPanel( Panel.copyPanel, self.panels(), config )
+        elif op == 'sync':
+            forEachPanel( Panel.syncPanel, self.panels(), config )
+        elif op == 'zip':
+            forEachPanel( Panel.zipPanel, self.panels(), config )
+            config.getBuildCache().save()
+        elif op == 'extract':
+            forEachPanel( Panel.installPackage, self.panels(), config )
+        elif op == 'erase':
+            panelTools.erasePanels( self.panels(), config )
+        elif op == 'list':
+            panelTools.listInstalledPanels( config, destOnly=True )
+        elif op == 'check':
+            panelTools.checkPanels( self.panels(), config )
+
+    # Seconds taken by each run of op: cold (after a reset) and warm
+    def time(self, op, repeat):
+        def timeOnce():
+            self.prepare( op )
+            output = io.StringIO()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout( output ):
+                self.run( op )
+            return time.perf_counter() - started
+
+        cold, warm = [], []
+        for i in range( repeat ):
+            self.reset()
+            cold.append( timeOnce() )
+        for i in range( repeat ):
+            warm.append( timeOnce() )
+        return cold, warm
+
+def gitCommit():
+    try:
+        return subprocess.check_output( ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                        cwd=os.path.dirname( os.path.abspath( __file__ ) ) ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def summary( seconds ):
+    return {'seconds': [round( s, 6 ) for s in seconds], 'median': round( statistics.median( seconds ), 6 ),
+            'min': round( min( seconds ), 6 )}
+
+def compare( results, baselineFile ):
+    with open( baselineFile ) as f:
+        baseline = {(r['op'], r['phase']): r for r in json.load( f )['results']}
+    print( "# %-10s %-5s %12s %12s %8s" % ("Operation", "Phase", "Before (ms)", "After (ms)", "Change") )
+    for r in results['results']:
+        before = baseline.get( (r['op'], r['phase']) )
+        if not before:
+            continue
+        change = (r['median'] / before['median'] - 1) * 100 if before['median'] else 0
+        print( "# %-10s %-5s %12.1f %12.1f %+7.1f%%" % (r['op'], r['phase'], before['median'] * 1000,
+                                                       r['median'] * 1000, change) )
+
+def main(argv):
+    argparser = argparse.ArgumentParser( description="Time the panel operations on generated panels" )
+    argparser.add_argument('--panels', type=int, default=20, metavar='N', help="Number of panels to generate")
+    argparser.add_argument('--files', type=int, default=150, metavar='N', help="Files in each panel")
+    argparser.add_argument('--ops', default=",".join( operations ), help="Comma separated operations to time")
+    argparser.add_argument('--repeat', type=int, default=3, metavar='N', help="Runs of each operation, cold and warm")
+    argparser.add_argument('--jobs', '-j', type=int, default=1, metavar='N', help="Panels worked on at once")
+    argparser.add_argument('--seed', type=int, default=1, help="Seed for the generated trees")
+    argparser.add_argument('--output', metavar='file', default=None, help="Save the results as JSON")
+    argparser.add_argument('--compare', metavar='file', default=None, help="Compare with earlier results")
+    argparser.add_argument('--keep', action='store_true', default=False, help="Keep the generated files")
+    args = argparser.parse_args( argv )
+
+    ops = [op for op in args.ops.split( "," ) if op]
+    unknown = [op for op in ops if op not in operations]
+    if unknown:
+        print( "# Error: unknown operations %s (expected %s)" % (", ".join( unknown ), ", ".join( operations )) )
+        return 2
+
+    workFolder = tempfile.mkdtemp( prefix="benchPanels" )
+    try:
+        bench = Bench( workFolder, args.jobs )
+        print( "# Generating %d panels of %d files in %s" % (args.panels, args.files, workFolder), file=sys.stderr )
+        makePanels( bench.srcFolder, args.panels, args.files, args.seed )
+        files, size = panelTools.measureTree( bench.srcFolder )
+
+        results = {'meta': {'commit': gitCommit(), 'python': platform.python_version(), 'platform': sys.platform,
+                            'panels': args.panels, 'files': files, 'bytes': size, 'jobs': args.jobs,
+                            'repeat': args.repeat, 'seed': args.seed},
+                   'results': []}
+        for op in ops:
+            cold, warm = bench.time( op, args.repeat )
+            for phase, seconds in (('cold', cold), ('warm', warm)):
+                results['results'].append( dict( op=op, phase=phase, **summary( seconds ) ) )
+                print( "# %-10s %-5s %10.1f ms" % (op, phase, statistics.median( seconds ) * 1000), file=sys.stderr )
+    finally:
+        if args.keep:
+            print( "# Generated files left in %s" % workFolder, file=sys.stderr )
+        else:
+            shutil.rmtree( workFolder, ignore_errors=True )
+
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            json.dump( results, f, indent=2 )
+    elif not args.compare:
+        print( json.dumps( results, indent=2 ) )
+    if args.compare:
+        compare( results, args.compare )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[1:] ) )
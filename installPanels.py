@@ -29,10 +29,34 @@
 # location for the platform.  PanelDebugMode must be "on" for a panel
 # to operate this way.
 #
+# The work is done by panelTools.py, which can also be imported to drive
+# the same steps from another program.
+#
 # Other options:
+#
 #  -d,--debug {on,off,status}   Set/check PanelDebugMode
-#  -l,--list                    List all panels installed
+#  -l,--list                    List all panels installed (with --dest, only the ones there)
+#     --format {text,json}      Output format for --list
+#  -t,--timings                 Report the time spent in each step (and for
+#                               each panel) when done
+#     --timings-file FILE       Also save the timings as JSON, or as a Chrome
+#                               trace with --timings-format trace
 #  -a,--allusers                Install panels for All users (requires sudo/admin)
+#     --check                   Check the panel manifests and sizes first (on its
+#                               own, only check them)
+#     --max-files N             With --check, the most files a panel may have
+#     --max-size MB             With --check, the largest a panel may be
+#     --ignore PATTERNS         Comma separated file name patterns that are never
+#                               installed or packaged (default: *.psd)
+#     --source FOLDER           Install the panels in FOLDER instead of the ones
+#                               next to this script (may be repeated)
+#     --dest DEST               Install into DEST: user, allusers, branch (the
+#                               --branch debug app) or a folder (may be repeated).
+#                               With several sources or destinations, the default
+#                               install, -s, -e and --rollback work on them all,
+#                               reading each panel file once for all destinations.
+#                               Only user, allusers and branch have their CEP
+#                               cache (the cache folder beside them) cleared
 #  -v,--version                 Set the CEP version used for registry/plist keys
 #  -c,--clean                   Clean the CEP caches
 #  -p,--package PASSWORD        Package the panels signed with a
@@ -40,480 +64,382 @@
 #  -i,--install                 Installs the signed panels created with -p into
 #                               the user panel location.  Does not require debug mode.
 #  -z,--zip                     Package the panels as a ZIP archives
+#     --delta BASE              Make delta packages in Targets from the earlier
+#                               versions of the panels in BASE: an old Targets
+#                               folder (comparing with the current -z/-p packages)
+#                               or an old source folder
+#     --install-delta DELTA...  Update installed panels with delta packages
 #  -e,--erase                   Remove the panels from the debug location
 #  -c,--clean                   Delete the CEP caches for the panels
 #  -r,--run                     Run Photoshop after copying.
-#
-#
-
-import os, sys, shutil, re, string, getpass, stat, datetime, platform, glob
-import argparse, subprocess, zipfile, ftplib, xml.dom.minidom, socket, errno
-if sys.platform == 'win32':
-    import winreg
-
-# Some options only make sense for internal Adobe developers
-adobeDevMachine = socket.getfqdn().endswith('.adobe.com')
-
-# Current version of Photoshop, for listing panels within the app
-psFolderName = "Adobe Photoshop 2022"
-
-psAppFolder = {"win32":"C:\\Program Files\\Adobe\\%s\\" % psFolderName,
-               "darwin": "/Applications/%s/%s.app/Contents/" % (psFolderName, psFolderName)
-              }[sys.platform]
+#  -j,--jobs N                  Work on up to N panels at once
+#     --zip-level N             Deflate level (0-9) used by -z
+#     --rebuild                 With -z or -p, rebuild panels that haven't changed
+#  -s,--sync                    Only copy new/changed files (and remove deleted
+#                               ones) instead of erasing and re-copying the panels
+#     --link-mode MODE          copy, hardlink, reflink or symlink the panel files
+#                               into the debug location (falls back to copying
+#                               where links aren't possible)
+#     --hash                    With --sync, compare file contents rather than
+#                               size and modification time
+#     --rollback                Swap the previously installed version of the
+#                               panels back in
+#  -w,--watch                   Keep running, copying source changes into the
+#                               debug location as they're saved
+#     --serve [SOCKET]          Run install/zip/package/... jobs given as JSON
+#                               lines on stdin (or a Unix socket), see PanelServer
+#
+#
+
+import os, sys, argparse, atexit, contextlib
+from panelTools import (Panel, PanelConfig, PanelError, PanelServer, PanelTargets, Timings, checkDestWritable,
+                        checkPanels, cleanCaches, clearExtensionCache, defaultDestPaths, defaultIgnore, devExtensionPath, discoverPanels,
+                        erasePanels, fanOutPanels, forEachPanel, installDelta, isAdobeDevMachine, linkModes,
+                        listInstalledPanels, panelExecutionState, printFanOutPlan, psExePath, runPanelJobs,
+                        setupRemoteDebugFiles, watchPanels)
+
+# At least 1, for counts like --jobs
+def positiveInt( text ):
+    value = int( text )
+    if value < 1:
+        raise argparse.ArgumentTypeError( "must be at least 1, not %d" % value )
+    return value
+
+def makeArgParser():
+    argparser = argparse.ArgumentParser(description="Manage Photoshop CEP panels.  By default, installs the panels for debugging.")
+    argparser.add_argument('--package', '-p', nargs=1, metavar='password', default=None,
+                           help="Package the item using the private certificate; specify the password used to create it")
+    argparser.add_argument('--zip', '-z', action='store_true', default=False,
+                           help="Create ZIP archives for BuildForge signing")
+    argparser.add_argument('--delta', nargs=1, metavar='base', default=None,
+                           help="Make delta packages from the panels' earlier versions in this folder")
+    argparser.add_argument('--install-delta', nargs='+', metavar='delta', default=None,
+                           help="Update the installed panels with delta packages")
+    argparser.add_argument('--debug', '-d', nargs='?', const='status', default=None, choices=['status', 'on', 'off'],
+                           help="Enable panel without signing")
+    argparser.add_argument('--version', '-v', default='10',
+                           help="CEP Version for setting PanelDebugMode")
+    argparser.add_argument('--run', '-r', action='store_true', default=False,
+                           help="Launch Photoshop after copy")
+    argparser.add_argument('--list', '-l', action='store_true', default=False,
+                           help="List all installed panels (with --dest, only those in DEST)")
+    argparser.add_argument('--format', default='text', choices=['text', 'json'],
+                           help="Output format for --list")
+    argparser.add_argument('--branch', '-b', nargs=1, metavar='branch_path', default=None,
+                           help='Path to branch for listing the extensions in that branch executable (Adobe developers)')
+    argparser.add_argument('--erase', '-e', action='store_true', default=False,
+                           help="Erase the panels from the debug install location")
+    argparser.add_argument('--clean', '-c', action='store_true', default=False,
+                           help="Clean CEP caches")
+    argparser.add_argument('--allusers', '-a', action='store_true', default=False,
+                           help="Install/erase panel for all users (requires sudo/admin)")
+    argparser.add_argument('--check', action='store_true', default=False,
+                           help="Check the panel manifests and sizes before doing anything else")
+    argparser.add_argument('--max-files', type=int, default=None, metavar='N',
+                           help="With --check, the most files a panel may have")
+    argparser.add_argument('--max-size', type=float, default=None, metavar='MB',
+                           help="With --check, the largest a panel may be, in MB")
+    argparser.add_argument('--ignore', default=",".join( defaultIgnore ), metavar='patterns',
+                           help="Comma separated file name patterns to leave out of installs and packages "
+                                "(default: %(default)s)")
+    argparser.add_argument('--source', action='append', metavar='folder', default=None,
+                           help="Folder holding panel sources (may be repeated; default: this script's folder)")
+    argparser.add_argument('--dest', action='append', metavar='dest', default=None,
+                           help="Install location: user, allusers, branch or a folder (may be repeated)")
+    argparser.add_argument('--install', '-i', action='store_true', default=False,
+                           help="Install the signed panels created with -p")
+    argparser.add_argument('--sync', '-s', action='store_true', default=False,
+                           help="Only copy new or changed files into the debug install location")
+    argparser.add_argument('--zip-level', type=int, default=6, choices=range(10), metavar='N',
+                           help="Compression level (0-9) for the ZIP archives")
+    argparser.add_argument('--rebuild', action='store_true', default=False,
+                           help="With -z or -p, rebuild archives even if the panel hasn't changed")
+    argparser.add_argument('--jobs', '-j', type=positiveInt, default=1, metavar='N',
+                           help="Work on up to N panels at once")
+    argparser.add_argument('--watch', '-w', action='store_true', default=False,
+                           help="Keep copying source changes into the debug install location")
+    argparser.add_argument('--rollback', action='store_true', default=False,
+                           help="Restore the previously installed version of the panels")
+    argparser.add_argument('--link-mode', default='copy', choices=linkModes,
+                           help="How panel files are put in the debug install location (default: copy)")
+    argparser.add_argument('--hash', action='store_true', default=False,
+                           help="With --sync, compare file contents instead of size and modification time")
+    argparser.add_argument('--serve', nargs='?', const='-', default=None, metavar='socket',
+                           help="Serve JSON-lines jobs from stdin, or from the given Unix socket")
+    argparser.add_argument('--timings', '-t', action='store_true', default=False,
+                           help="Report the time spent in each step on stderr")
+    argparser.add_argument('--timings-file', metavar='file', default=None,
+                           help="Save the timings to a file")
+    argparser.add_argument('--timings-format', default='json', choices=['json', 'trace'],
+                           help="Timings file format: JSON records, or a Chrome trace (chrome://tracing)")
+    return argparser
+
+def main(argv):
+    timings = Timings()
+    argumentsPhase = timings.start( "arguments" )
+    args = makeArgParser().parse_args( argv )
+
+    timings.enabled = bool( args.timings or args.timings_file )
+    timings.finish( argumentsPhase )
+    # Resolve the file name now, in case the current folder changes
+    timingsFile = os.path.abspath( args.timings_file ) if args.timings_file else None
+    atexit.register( timings.done, args.timings, timingsFile, args.timings_format )
+
+    if (sum([args.package!=None, args.zip, args.erase, args.install, args.sync, args.rollback, args.watch,
+             args.serve!=None, args.delta!=None, args.install_delta!=None]) > 1):
+        print( "# Error: Only one of -p, -z, -e, -i, -s, -w, --rollback, --serve, --delta or --install-delta is allowed" )
+        return 0
+
+    # Keep running, taking jobs from stdin or a socket
+    if (args.serve):
+        server = PanelServer( os.path.dirname( os.path.abspath( __file__ ) ), args.jobs )
+        if args.serve == '-':
+            server.serveStream( sys.stdin, sys.stdout )
+        else:
+            try:
+                server.serveSocket( args.serve )
+            except PanelError as err:
+                print( "## %s" % err )
+                return err.status
+        return 0
+
+    # With --list --format json only the listing goes to stdout, so it can
+    # be parsed; warnings and the like go to stderr
+    listStream = sys.stdout
+    with contextlib.redirect_stdout( sys.stderr if (args.list and args.format == 'json') else sys.stdout ):
+        return runArgs( args, timings, timingsFile, listStream )
+
+# The rest of main: find the panels and run the command on them
+def runArgs( args, timings, timingsFile, listStream ):
+    if (args.branch and not isAdobeDevMachine()):
+        print( "# Error: --branch is only available to Adobe developers" )
+        return 1
 
-# PS executable location, used just to launch PS
-PSexePath = psAppFolder + {"win32":"Photoshop.exe",
-                           "darwin": "MacOS/%s" % (psFolderName)}[sys.platform]
+    try:
+        configs = makeConfigs( args, timings )
+    except PanelError as err:
+        print( "# Error - %s" % err )
+        return err.status
 
-# Extract the panel ID and name from the Manifest file
-def getExtensionInfo(manifestPath):
-    extensionManifest = xml.dom.minidom.parse(manifestPath).getElementsByTagName("ExtensionManifest")[0]
+    try:
+        if len(configs) > 1:
+            status = runFanOut( args, configs )
+        else:
+            panelList = discoverPanels( configs[0] )
+            if len(panelList) == 0:
+                print( "# Warning - no extension manifests found" )
+                if (not (args.debug or args.list or args.install_delta)):
+                    return -1
+            if (args.check):
+                checkPanels( panelList, configs[0] )
+                if onlyChecking( args ):
+                    return 0
+            status = runCommand( args, configs[0], panelList, listStream )
+        if status is not None:
+            return status
+    except PanelError as err:
+        if str(err):
+            print( "## %s" % err )
+        return err.status
+
+    # Launch PS
+    if (args.run):
+        timings.done( args.timings, timingsFile, args.timings_format )
+        os.execl(psExePath(), "Adobe Photoshop")
+    return 0
+
+# --check with nothing else to do afterwards
+def onlyChecking( args ):
+    return not (args.package or args.zip or args.erase or args.install or args.sync or args.rollback or
+                args.watch or args.debug or args.list or args.clean or args.run or args.delta or args.install_delta)
+
+#
+# A PanelConfig for each source and destination.  By default, the source
+# is the folder this script is in (the top level folder containing the
+# extension sources), and the destination is the user's (or with
+# --allusers, everyone's) extension folder.
+#
+def makeConfigs( args, timings ):
+    allusersPath = (defaultDestPaths() or {}).get( True )
+    def destPath( dest ):
+        if dest in ('user', 'allusers'):
+            if not defaultDestPaths():
+                raise PanelError( "No %s extension folder for %s" % (dest, sys.platform) )
+            return defaultDestPaths()[dest == 'allusers']
+        if dest == 'branch':
+            if not args.branch:
+                raise PanelError( "--dest branch needs --branch" )
+            return args.branch[0] + devExtensionPath()
+        return dest
+
+    configs = []
+    for srcLocation in (args.source or [os.path.dirname( os.path.abspath( __file__ ) )]):
+        manifestCache = None    # Shared by every destination for the source
+        for dest in (args.dest or [None]):
+            # The branch's extension folder has a CEP cache beside it too
+            config = PanelConfig( srcLocation, destPath( dest ) if dest else None, allusers=args.allusers,
+                                  cepVersion=args.version, jobs=args.jobs, zipLevel=args.zip_level,
+                                  rebuild=args.rebuild, password=args.package[0] if args.package else None,
+                                  manifestCache=manifestCache, timings=timings, linkMode=args.link_mode,
+                                  ignore=[pattern for pattern in args.ignore.split( "," ) if pattern],
+                                  fileBudget=args.max_files,
+                                  byteBudget=args.max_size * 1e6 if args.max_size is not None else None,
+                                  clearCache=True if dest == 'branch' else None )
+            manifestCache = config.manifestCache
+            if (config.srcLocation, config.destPath) not in [(c.srcLocation, c.destPath) for c in configs]:
+                configs.append( config )
+
+    # If writing to the system folders, make sure we actually can
+    for destPath in {c.destPath for c in configs}:
+        if allusersPath and os.path.normpath( destPath ) == os.path.normpath( allusersPath ):
+            with timings.phase( "allusers write check" ):
+                checkDestWritable( destPath )
+    return configs
+
+#
+# Several sources and/or destinations: show what goes where, then work on
+# every (panel, destination) pair.  Installs read each file once for all
+# the destinations.
+#
+def runFanOut( args, configs ):
+    if (args.debug or args.package or args.install or args.zip or args.clean or args.list or args.watch or
+            args.delta or args.install_delta):
+        print( "# Error: several --source or --dest only work with the default install, -s, -e or --rollback" )
+        return 2
+    config = configs[0]
+    panelTargets = fanOutPanels( configs )
+    if len(panelTargets) == 0:
+        print( "# Warning - no extension manifests found" )
+        return -1
+    if (args.check):
+        for c in {c.srcLocation: c for c in configs}.values():
+            checkPanels( [t.panels[0] for t in panelTargets if t.panels[0].config.srcLocation == c.srcLocation], c )
+        if onlyChecking( args ):
+            return 0
+    printFanOutPlan( panelTargets )
+    panelList = [p for t in panelTargets for p in t.panels]
+    destConfigs = list( {c.destPath: c for c in configs}.values() )
+
+    if (args.erase):
+        forEachPanel( Panel.erasePanel, panelList, config, "erase", Panel.destPath )
+    elif (args.rollback):
+        forEachPanel( Panel.rollback, panelList, config, "rollback" )
+    elif (args.sync):
+        forEachPanel( lambda p: p.syncPanel(args.hash), panelList, config, "sync", Panel.srcPath )
+    else:
+        for c in destConfigs:
+            clearExtensionCache( c )
+        forEachPanel( PanelTargets.copyPanel, panelTargets, config, "copy", PanelTargets.srcPath )
 
-    if extensionManifest:
-        return ''.join('{}="{}" '.format(key, val) for key, val in extensionManifest.attributes.items())
+    if (args.erase or args.rollback):
+        for c in destConfigs:
+            clearExtensionCache( c )
     else:
-        print("# No ExtensionManifest for %s" % manifestPath)
+        setupRemoteDebugFiles( panelList, config )
+    if (args.run):
         return None
+    return 0
 
-class Panel:
+# Returns an exit status to stop with, or None to carry on (with --run)
+def runCommand( args, config, panelList, listStream=None ):
     #
-    # Pull out the panel ID and name from the manifest file
+    # Print or change PlayerDebugMode
     #
-    def __init__(self, extInfo, manifestPath):
-        m = re.search('ExtensionBundleId\s*=\s*["][\w.]*[.](\w+)["]', extInfo)
-        self.panelID = m.group(1) if m else "ERROR_FINDING_ID"
-        m = re.search('ExtensionBundleId\s*=\s*["]([\w.]+)["]', extInfo)
-        self.fullPanelID = m.group(1) if m else "ERROR_FINDING_ID"
-        m = re.search('ExtensionBundleName\s*=\s*["]([\w\s]+)["]', extInfo)
-        self.panelName = m.group(1) if m else self.panelID
-        self.panelSrcFolder = manifestPath.split(os.sep)[0]
-
-    def destPath(self):
-        return osDestPath + self.fullPanelID # (self.fullPanelID if args.allusers else self.panelName)
-
-    # Copy panel source to the deployment folder
-    def copyPanel(self):
-        destPath = self.destPath()
-        print( "# Copying " + srcLocation + self.panelSrcFolder + "\n  to " + destPath )
-        shutil.copytree( srcLocation + self.panelSrcFolder, destPath )
-
-    def cleanCache(self):
-        cachePath = os.getenv('HOME') + {'win32':'\\AppData\\Local\\Temp\\cep_cache\\',
-                                         'darwin':'/Library/Caches/CSXS/cep_cache/'}[sys.platform]
-        cacheFolders = glob.glob( cachePath + "*%s*" % self.fullPanelID )
-        for f in cacheFolders:
-            try:
-                shutil.rmtree( f )
-                print( "# Removing cache folder " + f )
-            except (OSError, IOError) as writeErr:
-                if (writeErr.errno == errno.EACCES):
-                    print( "# PS still running? Unable to delete " + f )
-                else:
-                    print( "# Unable to remove cache folder " + f )
+    if (args.debug):
+        panelDebugValue = {'on':'1', 'off':'0', 'status':None}[args.debug]
+        oldPanelDebugValue = panelExecutionState( 'PlayerDebugMode', config.cepVersion, panelDebugValue )
 
-    # Unlock, then remove the panels
-    def erasePanel(self):
-        # Because Perforce may leave them locked.
-        def makeWritable( path ):
-            os.chmod( path, os.stat( path ).st_mode | stat.S_IWRITE )
-
-        # Unlock, then remove the panels
-        destPath = self.destPath()
-        if (os.path.exists( destPath )):
-            print( "# Removing " + destPath )
-            for df in [root + os.sep + f for root, dirs, files in os.walk(destPath) for f in files]:
-                makeWritable( df )
-            shutil.rmtree( destPath )
-
-    # Create the .debug file for enabling the remote debugger
-    def debugFilename(self):
-        return os.path.join( self.destPath(), ".debug" )
-
-    # Setup/remove remote debug config files
-    def createRemoteDebugXML(self):
-        global portNumber
-        extensionTemplate = """  <Extension Id="%s">
-    <HostList>
-      <Host Name="PHXS" Port="%d"/>
-    </HostList>
-  </Extension>
-"""
-        # Fish the ID for each extension in the package out of the CSXS/manifest.xml file
-        manifestXML = xml.dom.minidom.parse( os.path.join( srcLocation, self.panelSrcFolder, "CSXS", "manifest.xml" ) )
-        extensions = manifestXML.getElementsByTagName("ExtensionList")[0].getElementsByTagName("Extension")
-        debugText = """<?xml version="1.0" encoding="UTF-8"?>\n"""
-        debugText += "<ExtensionList>\n"
-        for ext in extensions:
-            extName = ext.getAttribute("Id")
-            debugText += extensionTemplate % (extName, portNumber)
-            print( "# Remote Debug %s at http://localhost:%d" % (extName, portNumber) )
-            portNumber += 1
-        debugText += "</ExtensionList>\n"
-        try:
-            open(self.debugFilename(), 'w' ).write(debugText)
-        except IOError as writeErr:
-            if (writeErr.errno == errno.ENOENT):
-               print( "# Note: Panel %s is not installed" % self.panelName )
-
-    def setupRemoteDebugFile(self, debugEnabled):
-        if debugEnabled:
-            self.createRemoteDebugXML()
+        if (args.debug == 'status'):
+            if oldPanelDebugValue == '1':
+                print( "# Debug enabled - panel will run without signing" )
+            else:
+                print( "# Panel only runs if a signed package is installed" )
         else:
-            if (os.path.exists( self.debugFilename() )):
-                os.remove( self.debugFilename() )
-                print( "# Removing debug file for %s" % self.panelName )
+            # Only report if the value actually changed, so you can verify
+            # the change actually "stuck"
+            if panelDebugValue != oldPanelDebugValue:
+                print( "# Panel debug mode " + ("enabled" if panelDebugValue=='1' else "disabled") )
+                setupRemoteDebugFiles( panelList, config )
 
     #
     # Create a signed double-clickable install package
     # There's some more info on self-signing here:
     # http://forums.adobe.com/message/5714997
     #
-    def packagePanel(self):
-        pkgTargetFolder = getTargetFolder()
-        timestampURL = "http://timestamp.digicert.com"
-#        timestampURL = "http://tsa.starfieldtech.com"
-
-        pkgFile = pkgTargetFolder + self.fullPanelID + ".zip"
-        # Must remove the file first, otherwise contents not updated.
-        if os.path.exists( pkgFile ):
-            os.remove( pkgFile )
-        print( "# Creating package: '%s'" % pkgFile )
-        result = ""
+    elif (args.package):
         try:
-            result = subprocess.check_output('ZXPSignCmd -sign %s "%s" %s %s -tsa %s'
-                                             % (srcLocation + self.panelSrcFolder, pkgFile,
-                                                certPath, args.package[0], timestampURL), shell=True)
-        except subprocess.CalledProcessError as procErr:
-            if (procErr.returncode == 1):
-                print()
-                print( "## Signing package failed.  ZXPSignCmd is not installed?" )
-            else:
-                print( "## Signing package %s failed." % (self.panelName + ".zip") )
-            sys.exit(procErr.returncode)
-        else:
-            print( result )
-
-    # Make the zip of the panel source
-    def zipPanel(self):
-        zipTargetFolder = getTargetFolder()
-
-        zipTargetFile = zipTargetFolder + self.fullPanelID + ".zip"
-        print( "# Creating archive: " + zipTargetFile )
-        zf = zipfile.ZipFile( zipTargetFile, 'w', zipfile.ZIP_DEFLATED )
-        os.chdir( srcLocation + self.panelSrcFolder )
-        fileList = [root + os.sep + f for root, dirs, files in os.walk(".") for f in files]
-        for f in fileList:
-            zf.write( f )
-        zf.close()
-
-# For future reference, the Extension Manager stages the bundle in
-#
-# (Mac) /Library/Application Support/Adobe/Extension Manager CC/EM Store/Photoshop/
-# (Win) %APPDATA%\Adobe\Extension Manager CC\EM Store\Photoshop{32,64} (No?)
-# (Win) %APPDATA%\Adobe.ExMan\Local Store\Photoshop{32,64}    (No?)
-# (Win) C:\ProgramData\Adobe\Extension Manager CC\EM Store\Shared\   (YES?!)
-#
-# and deploys it to:
-#
-# (Mac) /Library/Application Support/Adobe/CEP/extensions/  (for all users)
-#       ~/Library/Application Support/Adobe/CEP/extensions/ (for current user)
-# (Win) C:\Program Files\Common Files\Adobe\CEP\extensions\  (for all users)
-# 		C:\<username>\AppData\Roaming\Adobe\CEP\extensions\  (for current user)
-# Note the Adobe CC Panel deploys them to:
-# (Win) C:\Program Files(x86)\Common Files\Adobe\CEP\extensions\[extensionID]
-#
-
-argparser = argparse.ArgumentParser(description="Manage Photoshop CEP panels.  By default, installs the panels for debugging.")
-argparser.add_argument('--package', '-p', nargs=1, metavar='password', default=None,
-                       help="Package the item using the private certificate; specify the password used to create it")
-argparser.add_argument('--zip', '-z', action='store_true', default=False,
-                       help="Create ZIP archives for BuildForge signing")
-argparser.add_argument('--debug', '-d', nargs='?', const='status', default=None, choices=['status', 'on', 'off'],
-                       help="Enable panel without signing")
-argparser.add_argument('--version', '-v', default='10',
-                       help="CEP Version for setting PanelDebugMode")
-argparser.add_argument('--run', '-r', action='store_true', default=False,
-                       help="Launch Photoshop after copy")
-argparser.add_argument('--list', '-l', action='store_true', default=False,
-                       help="List all installed panels")
-if (adobeDevMachine):
-    argparser.add_argument('--branch', '-b', nargs=1, metavar='branch_path', default=None,
-                           help='Path to branch for listing the extensions in that branch executable')
-argparser.add_argument('--erase', '-e', action='store_true', default=False,
-                       help="Erase the panels from the debug install location")
-argparser.add_argument('--clean', '-c', action='store_true', default=False,
-                       help="Clean CEP caches")
-argparser.add_argument('--allusers', '-a', action='store_true', default=False,
-                       help="Install/erase panel for all users (requires sudo/admin)")
-argparser.add_argument('--install', '-i', action='store_true', default=False,
-                       help="Install the signed panels created with -p")
-args = argparser.parse_args( sys.argv[1:] )
+            forEachPanel( Panel.packagePanel, panelList, config, "package", Panel.srcPath )
+        finally:
+            config.getBuildCache().save()
 
-if (sum([args.package!=None, args.zip, args.erase, args.install]) > 1):
-    print( "# Error: Only one of -p, -z, -e or -i is allowed" )
-    sys.exit(0)
-
-# Where to place the panel.
-extensionSubpath = os.path.normpath("/Adobe/CEP/extensions") + os.path.sep
-winAppData = os.getenv("APPDATA") if (sys.platform == "win32") else ""
-winCommon = os.getenv("CommonProgramFiles") if (sys.platform == "win32") else ""
-allDestPaths = { "win32": {False:winAppData + extensionSubpath,
-                           True:winCommon + extensionSubpath},
-                 "darwin":{False:os.path.expanduser("~")+"/Library/Application Support" + extensionSubpath,
-                           True:"/Library/Application Support" + extensionSubpath}
-               }[sys.platform]
-devExtensionPath = { "win32": "\\photoshop\\Targets\\x64\\Debug\\Required\\CEP\\extensions\\",
-                     "darwin": "/photoshop/Targets/Debug_x86_64/%s/Contents/Required/CEP/extensions/"
-                                % psFolderName
-                   }[sys.platform]
-osDestPath = allDestPaths[args.allusers]
-
-# If writing to the system folders, make sure we actually can
-if (args.allusers):
-    try:
-        if (not os.path.exists(osDestPath)):
-           os.makedirs(osDestPath)
-        testfile = osDestPath + os.sep + "test.txt"
-        f = open( testfile, 'w')
-        f.write("test")
-        f.close()
-        os.remove(testfile)
-    except (OSError, IOError) as writeErr:
-        if (writeErr.errno == errno.EACCES):
-           print( "# Error - Must run as admin to access %s" % osDestPath )
+    #
+    # Unpack packaged panels into the user's extension folder
+    #
+    elif (args.install):
+        if (not os.path.exists(config.destPath)):
+            os.makedirs(config.destPath)
+        packagedPanels = [p for p in panelList if os.path.exists( p.packagePath() )]
+        # Packaged panels replace the installed ones in place; remove the rest
+        runPanelJobs( Panel.erasePanel, [p for p in panelList if p not in packagedPanels], config.jobs,
+                      "erase", Panel.destPath, config.timings )
+        clearExtensionCache( config )
+        if len(packagedPanels) > 0:
+            forEachPanel( Panel.installPackage, packagedPanels, config, "extract", Panel.packagePath )
         else:
-           print( "# Error - Unable to access %s" % osDestPath )
-        sys.exit(1)
-
-#
-# Find installable extensions.  Assumes this script is in
-# the top level folder containing the extension sources.
-#
-srcLocation = sys.path[0] + os.sep
-os.chdir(srcLocation)
-manifestFiles = glob.glob("*/CSXS/manifest.xml")
-
-if len(manifestFiles) == 0:
-    print( "# Warning - no extension manifests found" )
-    if (not (args.debug or args.list)):
-        sys.exit(-1)
-
-# Load the panel info from the extension
-panelList = [Panel(getExtensionInfo(f), f) for f in manifestFiles if getExtensionInfo(f)]
-
-# Location of the certificate file used to sign the package.
-certPath = os.path.join( srcLocation, "cert", "panelcert.p12" )
-
-# Base port number used for remote debugger (each extra panel increments it)
-portNumber = 8000
-
-def getTargetFolder():
-    targetFolder = os.path.abspath( os.path.join( srcLocation, "Targets" ) ) + os.sep
-    if (not os.path.exists( targetFolder )):
-        os.makedirs( targetFolder )
-    return targetFolder
-
-def erasePanels():
-    # Unlock, then remove the panels
-    for p in panelList:
-        p.erasePanel()
-
-    # Leaving the cache around can cause problems.
-    cachePath = os.path.normpath( osDestPath + "../cache" )
-    if os.path.exists(cachePath):
-        shutil.rmtree(cachePath);
-
-def listInstalledPanels():
-    def displayPanelsInfo(panelPath, title):
-        if (not os.path.exists(panelPath)):
-            return
-        panelList = glob.glob(panelPath + "*")
-        if len(panelList) == 0:
-            return
-        print( "\n# (%s)\n# Panels in %s" % (title, os.path.dirname(panelList[0])) )
-        for f in panelList:
-            # Fish the ID for each extension in the package out of the CSXS/manifest.xml file
-            panelManifest = os.path.join( f, "CSXS", "manifest.xml" )
-            if not os.path.exists(panelManifest):
-                print("## Manifest missing: %s" % panelManifest)
-                continue
-            manifestXML = xml.dom.minidom.parse( panelManifest )
-            name = os.path.basename(f)
-            manifest = manifestXML.getElementsByTagName("ExtensionManifest")
-            # Only print the bundle (names) if they're different from the folder name
-            extNames = [x.getAttribute("ExtensionBundleName") for x in manifest if x.getAttribute("ExtensionBundleName") != name]
-            extVersions = [x.getAttribute("ExtensionBundleVersion") for x in manifest]
-            extNames = " (" + ",".join(extNames) + ")" if len(extNames) > 0 else ""
-            extVersions = " [" + ",".join(extVersions) + "]" if len(extVersions) > 0 else ""
-            print( "  %s%s%s" % (name, extVersions, extNames) )
-
-    displayPanelsInfo( allDestPaths[True], "for all users")
-    displayPanelsInfo( allDestPaths[False], "for this user")
-    
-    psAppPath = psAppFolder + "Required" + os.sep + "CEP" + os.sep + "extensions" + os.sep
-    
-    displayPanelsInfo( psAppPath, "installed with Photoshop")
-
-    # For Adobe developers, also list extensions found in the specified debug branch
-    if (adobeDevMachine and args.branch):
-        displayPanelsInfo( args.branch[0] + devExtensionPath, "for branch %s debug app" % args.branch[0])
-
-#
-# Examine the state of debugKey (either "Logging" or "PlayerDebugMode")
-# If panelDebugValue is not None, set the to that value.
-# returns the previous value of the debugKey
-#
-def panelExecutionState( debugKey, panelDebugValue=None ):
-    oldPanelDebugValue = 'err'
-    CEPversion = 'CSXS.' + args.version
-
-    # Windows: add HKEY_CURRENT_USER/Software/Adobe/CSXS.5 (add key) PlayerDebugMode [String] "1"
-    if sys.platform == 'win32':
-        def tryKey(key):
-            try:
-                return winreg.QueryValueEx( key, debugKey )
-            except:
-                return None
-
-        access = winreg.KEY_READ if (not panelDebugValue) else winreg.KEY_ALL_ACCESS
-
-        ky = winreg.OpenKey( winreg.HKEY_CURRENT_USER,
-                              "Software\\Adobe\\%s" % CEPversion, 0, access )
-        keyValue = tryKey( ky )
-        oldPanelDebugValue = '1' if keyValue and (keyValue[0] == '1') else '0'
-
-        if (panelDebugValue):
-            if not keyValue:
-                winreg.CreateKey( ky, debugKey )
-            winreg.SetValueEx( ky, debugKey, 0, winreg.REG_SZ, panelDebugValue );
-
-        winreg.CloseKey( ky )
-
-    # Mac: ~/Library/Preferences/com.adobe.CSXS.5.plist (add row) PlayerDebugMode [String] "1"
-    elif sys.platform == "darwin":
-        import subprocess, plistlib
-        plistFile = os.path.expanduser( "~/Library/Preferences/com.adobe.%s.plist" % CEPversion )
-
-        # First, make sure the Plist is in text format
-        subprocess.check_output( "plutil -convert xml1 " + plistFile, shell=True )
-        plist = plistlib.readPlist( plistFile )
-        oldPanelDebugValue = '1' if ((debugKey in plist) and (plist[debugKey] == '1')) else '0'
-
-        if (panelDebugValue):
-            plist[debugKey] = panelDebugValue
-            plistlib.writePlist( plist, plistFile )
-
-            # On Mac OS X 10.9 and higher, must reset the cfprefsd process
-            # before changes in a plist file take effect
-            macOSVer = [int(x) for x in platform.mac_ver()[0].split('.')]
-            if (macOSVer[0] == 10) and (macOSVer[1] >= 9):
-                proc = subprocess.Popen("ps ax | grep cfprefsd | grep -v grep", shell=True,
-                                        stdout=subprocess.PIPE).stdout.read()
-                procID = re.findall("^\s*(\d+)", proc.decode('utf-8'), re.MULTILINE)
-                if (procID):
-                    for p in procID:
-                        print( "# MacOS 10.9: Killing cfprefsd process ID: " + p )
-                    os.system( "kill -HUP " + p )
-                else:
-                    print( "# MacOS 10.9: No cfprefsd process" )
-
-    else:
-        print( "Error: Unsupported platform: " + sys.platform )
-        sys.exit(0)
+            print( "# No packaged panels to install, use --package first" )
+            return 0
+    #
+    # Create a .zip archive
+    #
+    elif (args.zip):
+        try:
+            forEachPanel( Panel.zipPanel, panelList, config, "zip", Panel.srcPath )
+        finally:
+            config.getBuildCache().save()
 
-    return oldPanelDebugValue
+    #
+    # Ship just the changes since an earlier version
+    #
+    elif (args.delta):
+        forEachPanel( lambda p: p.makeDelta( args.delta[0] ), panelList, config, "delta", Panel.srcPath )
 
-#
-# Setup/remove remote debug config files
-#
-def setupRemoteDebugFiles():
-    debugEnabled = panelExecutionState( 'PlayerDebugMode' ) == '1'
-    for p in panelList:
-        p.setupRemoteDebugFile(debugEnabled)
+    elif (args.install_delta):
+        with config.timings.phase( "install delta" ):
+            for deltaPath in args.install_delta:
+                installDelta( os.path.abspath( deltaPath ), config )
+        clearExtensionCache( config )
 
-#
-# Argument processing starts here
-#
-# Print or change PlayerDebugMode
-#
-if (args.debug):
-    panelDebugValue = {'on':'1', 'off':'0', 'status':None}[args.debug]
-    oldPanelDebugValue = panelExecutionState( 'PlayerDebugMode', panelDebugValue )
+    elif (args.erase):
+        erasePanels( panelList, config )
 
-    if (args.debug == 'status'):
-        if oldPanelDebugValue == '1':
-            print( "# Debug enabled - panel will run without signing" )
-        else:
-            print( "# Panel only runs if a signed package is installed" )
-    else:
-        # Only report if the value actually changed, so you can verify
-        # the change actually "stuck"
-        if panelDebugValue != oldPanelDebugValue:
-            print( "# Panel debug mode " + ("enabled" if panelDebugValue=='1' else "disabled") )
-            setupRemoteDebugFiles()
+    elif (args.clean):
+        cleanCaches( panelList, config )
 
-#
-# Create a signed double-clickable install package
-# There's some more info on self-signing here:
-# http://forums.adobe.com/message/5714997
-#
-elif (args.package):
-    for p in panelList:
-        p.packagePanel()
+    elif (args.list):
+        with config.timings.phase( "list" ):
+            listInstalledPanels( config, args.format, args.branch[0] if args.branch else None, listStream,
+                                 destOnly=bool( args.dest ) )
 
-#
-# Unpack packaged panels into the user's extension folder
-#
-elif (args.install):
-    erasePanels()
-    if (not os.path.exists(osDestPath)):
-        os.makedirs(osDestPath)
-    pkgTargetFolder = getTargetFolder()
-    zxpFiles = list(filter(os.path.exists, [pkgTargetFolder + p.fullPanelID + ".zip" for p in panelList]))
-    if len(zxpFiles) > 0:
-        for f in zxpFiles:
-            zps = zipfile.ZipFile( f )
-            destFolder = osDestPath + os.path.splitext(os.path.basename(f))[0]
-            print( "# Extracting %s \n   to %s" % (f, destFolder) )
-            os.mkdir( destFolder )
-            os.chdir( destFolder )
+    elif (args.rollback):
+        forEachPanel( Panel.rollback, panelList, config, "rollback" )
+        clearExtensionCache( config )
+    #
+    # Update the debug locations in place, only copying what changed
+    #
+    elif (args.sync):
+        forEachPanel( lambda p: p.syncPanel(args.hash), panelList, config, "sync", Panel.srcPath )
+        setupRemoteDebugFiles( panelList, config )
 
-            zipNames = zps.namelist()
-            for n in zipNames:
-                if (n[-1] == '/'):
-                    os.mkdir( os.path.normpath( n ))
-                else:
-                    open( os.path.normpath(n), 'wb' ).write(zps.read(n))
-            zps.close()
+    elif (args.watch):
+        watchPanels( panelList, config )
+    #
+    # Default; copy the files directly into their debug locations
+    #
     else:
-        print( "# No packaged panels to install, use --package first" )
-        sys.exit(0)
-#
-# Create a .zip archive
-#
-elif (args.zip):
-    for p in panelList:
-        p.zipPanel()
-
-elif (args.erase):
-    erasePanels()
-
-elif (args.clean):
-    for p in panelList:
-        p.cleanCache()
-
-elif (args.list):
-    listInstalledPanels()
-#
-# Default; copy the files directly into their debug locations
-#
-else:
-    erasePanels()
-    # Copy the files
-    for p in panelList:
-        p.copyPanel()
-    setupRemoteDebugFiles()
+        clearExtensionCache( config )
+        # Copy the files
+        forEachPanel( Panel.copyPanel, panelList, config, "copy", Panel.srcPath )
+        setupRemoteDebugFiles( panelList, config )
 
-# Launch PS
-if (args.run):
-    os.execl(PSexePath, "Adobe Photoshop")
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[1:] ) )
@@ -0,0 +1,2390 @@
+#
+# Copyright (c) 2013-2015 Adobe Systems Incorporated. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+#
+# Library behind installPanels.py: finds the extension panels under a
+# source folder and installs, packages, lists and removes them.  Nothing
+# happens at import time; everything works from a PanelConfig, so one
+# process can work with several source folders and destinations.  Modules
+# only some commands need (zipfile, xml, subprocess, winreg, ...) are
+# imported when first used.
+#
+
+import os, sys, shutil, stat, datetime, glob, threading, io, traceback
+import errno, hashlib, json, collections, time, functools, re, fnmatch
+import concurrent.futures
+
+# Raised for problems that should stop the current command (or panel).
+# status is the exit status installPanels.py uses for it.
+class PanelError(Exception):
+    def __init__(self, message, status=1):
+        Exception.__init__( self, message )
+        self.status = status
+
+# Current version of Photoshop, for listing panels within the app
+psFolderName = "Adobe Photoshop 2022"
+
+def psAppFolder():
+    return {"win32":"C:\\Program Files\\Adobe\\%s\\" % psFolderName,
+            "darwin": "/Applications/%s/%s.app/Contents/" % (psFolderName, psFolderName)
+           }.get(sys.platform, "")
+
+# PS executable location, used just to launch PS
+def psExePath():
+    return psAppFolder() + {"win32":"Photoshop.exe",
+                            "darwin": "MacOS/%s" % (psFolderName)}.get(sys.platform, "")
+
+# Where to place the panels, for {False: this user, True: all users}.
+# None on platforms without Photoshop; the destination must be given.
+extensionSubpath = os.path.normpath("/Adobe/CEP/extensions") + os.path.sep
+
+def defaultDestPaths():
+    if sys.platform == "win32":
+        return {False:os.getenv("APPDATA") + extensionSubpath,
+                True:os.getenv("CommonProgramFiles") + extensionSubpath}
+    if sys.platform == "darwin":
+        return {False:os.path.expanduser("~")+"/Library/Application Support" + extensionSubpath,
+                True:"/Library/Application Support" + extensionSubpath}
+    return None
+
+# True if path is this user's or the all users' extension folder
+def isDefaultDestPath(path):
+    def normalized(path):
+        return os.path.normcase( os.path.normpath( os.path.abspath( path ) ) )
+    return normalized( path ) in {normalized( p ) for p in (defaultDestPaths() or {}).values()}
+
+def devExtensionPath():
+    return { "win32": "\\photoshop\\Targets\\x64\\Debug\\Required\\CEP\\extensions\\",
+             "darwin": "/photoshop/Targets/Debug_x86_64/%s/Contents/Required/CEP/extensions/"
+                        % psFolderName
+           }.get(sys.platform, "")
+
+def cepCachePath():
+    cacheSubpath = {'win32':'\\AppData\\Local\\Temp\\cep_cache\\',
+                    'darwin':'/Library/Caches/CSXS/cep_cache/'}.get(sys.platform)
+    return os.getenv('HOME') + cacheSubpath if (cacheSubpath and os.getenv('HOME')) else None
+
+# Some options only make sense for internal Adobe developers.  Looking up
+# the host name can wait on DNS, so it's only done if one of them is used.
+@functools.lru_cache(maxsize=None)
+def isAdobeDevMachine():
+    import socket
+    return socket.getfqdn().endswith('.adobe.com')
+
+#
+# The parts of a CSXS/manifest.xml file the script uses.  The bundle ID
+# and name come from the ExtensionManifest attributes, the extension IDs
+# from the ExtensionList, and the host app names from the HostList.
+#
+class ExtensionManifest:
+    __slots__ = ('path', 'bundleID', 'bundleName', 'bundleVersion', 'extensionIDs', 'hosts',
+                 'mainPaths', 'scriptPaths')
+    cachedFields = __slots__[1:]
+
+    def __init__(self, path, bundleID=None, bundleName=None, bundleVersion=None, extensionIDs=(), hosts=(),
+                 mainPaths=(), scriptPaths=()):
+        self.path = path
+        self.bundleID = bundleID
+        self.bundleName = bundleName
+        self.bundleVersion = bundleVersion
+        self.extensionIDs = tuple(extensionIDs)
+        self.hosts = tuple(hosts)
+        # Files the extensions load (relative to the panel folder)
+        self.mainPaths = tuple(mainPaths)
+        self.scriptPaths = tuple(scriptPaths)
+
+    # Single streaming pass over the XML, rather than building a DOM
+    @classmethod
+    def parse(cls, path):
+        import xml.etree.ElementTree
+        attrs = None
+        extensionIDs, hosts = [], []
+        resources = {"MainPath": [], "ScriptPath": []}
+        parents = []
+        for event, elem in xml.etree.ElementTree.iterparse( path, events=('start', 'end') ):
+            if event == 'end':
+                parents.pop()
+                if parents and parents[-1] == "Resources" and elem.tag in resources and (elem.text or "").strip():
+                    resources[elem.tag].append( elem.text.strip() )
+                elem.clear()
+                continue
+            if not parents:
+                if elem.tag == "ExtensionManifest":
+                    attrs = dict(elem.attrib)
+            elif parents[-1] == "ExtensionList" and elem.tag == "Extension":
+                extensionIDs.append( elem.get("Id") )
+            elif parents[-1] == "HostList" and elem.tag == "Host":
+                hosts.append( elem.get("Name") )
+            parents.append( elem.tag )
+
+        if attrs is None:
+            return None
+        return cls( path, attrs.get("ExtensionBundleId"), attrs.get("ExtensionBundleName"),
+                    attrs.get("ExtensionBundleVersion"), extensionIDs, hosts,
+                    resources["MainPath"], resources["ScriptPath"] )
+
+    def cacheEntry(self):
+        return {k: getattr(self, k) for k in self.cachedFields}
+
+#
+# Parsed manifests are remembered between runs in a JSON file (by default
+# Targets/manifestCache.json), keyed by the manifest's full path and
+# checked against its size and mtime.
+#
+class ManifestCache:
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def getEntries(self):
+        with self.lock:
+            if self.entries is None:
+                try:
+                    with open( self.cacheFile ) as f:
+                        self.entries = json.load( f )
+                except (OSError, IOError, ValueError):
+                    self.entries = {}
+        return self.entries
+
+    # Returns the ExtensionManifest, or None (printing why, if report is set)
+    def load(self, manifestPath, report=True):
+        import xml.etree.ElementTree
+        entries = self.getEntries()
+        fullPath = os.path.abspath( manifestPath )
+        fileStat = os.stat( fullPath )
+        stamp = [fileStat.st_size, fileStat.st_mtime_ns]
+        entry = entries.get( fullPath )
+        # (Entries from before a field was added are read again)
+        if (entry and entry['stamp'] == stamp and
+                (not entry['manifest'] or set( ExtensionManifest.cachedFields ) <= entry['manifest'].keys())):
+            fields = entry['manifest']
+            manifest = ExtensionManifest( manifestPath, **fields ) if fields else None
+        else:
+            try:
+                manifest = ExtensionManifest.parse( manifestPath )
+            except xml.etree.ElementTree.ParseError as parseErr:
+                if report:
+                    print( "# Unable to read %s: %s" % (manifestPath, parseErr) )
+                return None
+            with self.lock:
+                entries[fullPath] = {'stamp': stamp, 'manifest': manifest.cacheEntry() if manifest else None}
+                self.dirty = True
+
+        if not manifest and report:
+            print("# No ExtensionManifest for %s" % manifestPath)
+        return manifest
+
+    # Forget manifests under the given folders that weren't seen when listing them
+    def prune(self, folders, seenManifests):
+        entries = self.getEntries()
+        seen = set( os.path.abspath( m ) for m in seenManifests )
+        prefixes = tuple( os.path.abspath( f ) + os.sep for f in folders )
+        with self.lock:
+            for path in [p for p in entries if p.startswith( prefixes ) and p not in seen]:
+                del entries[path]
+                self.dirty = True
+
+    # Several threads (server jobs) may load and save at once, and other
+    # runs may be reading the file, so it's written aside and swapped in
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tempFile = "%s.%d.tmp" % (self.cacheFile, os.getpid())
+            try:
+                os.makedirs( os.path.dirname( self.cacheFile ), exist_ok=True )
+                with open( tempFile, 'w' ) as f:
+                    json.dump( self.entries, f )
+                os.replace( tempFile, self.cacheFile )
+                self.dirty = False
+            except (OSError, IOError):
+                pass    # The cache is only an optimization
+
+# Files written into the install location that don't come from the panel source
+generatedFiles = {".debug"}
+
+#
+# Remote debugger ports (see Panel.createRemoteDebugXML), kept in a small
+# JSON file so an extension keeps its port from one run to the next, and
+# a debugger left attached to it keeps working as other panels come and
+# go.  An extension without one gets the lowest port from basePort up that
+# isn't assigned to another extension or already being listened on.
+#
+# Photoshop loads the extensions from every extension folder together, so
+# there's one file for the user (debugPortsPath), keyed by extension ID,
+# whichever folder an extension is installed in.
+#
+def debugPortsPath():
+    return os.path.join( os.path.expanduser( "~" ), ".panelDebugPorts.json" )
+
+class DebugPorts:
+    opened = {}
+    openLock = threading.Lock()
+
+    # The same DebugPorts for every config using the same file
+    @classmethod
+    def open(cls, stateFile):
+        with cls.openLock:
+            key = os.path.normcase( os.path.abspath( stateFile ) )
+            if key not in cls.opened:
+                cls.opened[key] = cls( stateFile )
+            return cls.opened[key]
+
+    def __init__(self, stateFile, basePort=8000):
+        self.stateFile = stateFile
+        self.basePort = basePort
+        try:
+            with open( stateFile ) as f:
+                self.ports = json.load( f )
+        except (OSError, IOError, ValueError):
+            self.ports = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def isFree(port):
+        import socket
+        with socket.socket( socket.AF_INET, socket.SOCK_STREAM ) as probe:
+            try:
+                probe.bind( ("127.0.0.1", port) )
+                return True
+            except OSError:
+                return False
+
+    def portFor(self, extensionID):
+        with self.lock:
+            if extensionID not in self.ports:
+                taken = set( self.ports.values() )
+                port = self.basePort
+                while port in taken or not self.isFree( port ):
+                    port += 1
+                self.ports[extensionID] = port
+                self.dirty = True
+            return self.ports[extensionID]
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                os.makedirs( os.path.dirname( self.stateFile ), exist_ok=True )
+                with open( self.stateFile, 'w' ) as f:
+                    json.dump( self.ports, f, indent=1, sort_keys=True )
+                self.dirty = False
+            except (OSError, IOError):
+                pass    # Ports will just be handed out again next time
+
+# Panel source files that are never installed or packaged (--ignore), such
+# as the Photoshop documents the icons are made from
+defaultIgnore = ("*.psd",)
+
+def isIgnored( name, ignore ):
+    return any( fnmatch.fnmatch( name, pattern ) for pattern in ignore )
+
+# Because Perforce may leave them locked.
+def makeWritable( path ):
+    os.chmod( path, os.stat( path ).st_mode | stat.S_IWRITE )
+
+# rmtree error handler: unlock the entry (and its folder) and try again.
+# Only the few entries that actually fail pay for the extra chmod.  The
+# target of a --link-mode symlink is left alone, and so is a file with
+# other hard links: its mode is shared with them (a --link-mode hardlink
+# install's source file), and its folder being writable is enough.
+def removeLocked( function, path, excInfo ):
+    if function not in (os.remove, os.unlink, os.rmdir) or not os.path.lexists( path ):
+        raise excInfo[1]
+    makeWritable( os.path.dirname( path ) )
+    if function is os.rmdir or not (os.path.islink( path ) or os.lstat( path ).st_nlink > 1):
+        makeWritable( path )
+    function( path )
+
+# Threads used for removing a whole panel
+removeWorkers = 4
+
+#
+# Remove a file or folder in one pass over the tree.  With workers > 1,
+# the subfolders at the top are removed on that many threads (most of the
+# time goes on waiting for the filesystem, which threads can overlap).
+#
+def removePath( path, workers=1 ):
+    if os.path.isdir( path ) and not os.path.islink( path ):
+        if workers > 1:
+            subfolders = [e.path for e in os.scandir( path ) if e.is_dir( follow_symlinks=False )]
+            if len(subfolders) > 1:
+                with concurrent.futures.ThreadPoolExecutor( max_workers=min( workers, len(subfolders) ) ) as pool:
+                    list( pool.map( removePath, subfolders ) )
+        shutil.rmtree( path, onerror=removeLocked )
+    else:
+        try:
+            os.remove( path )
+        except PermissionError:
+            removeLocked( os.remove, path, sys.exc_info() )
+
+def fileDigest( path ):
+    digest = hashlib.sha1()
+    with open( path, 'rb' ) as f:
+        for block in iter( lambda: f.read( 1024 * 1024 ), b'' ):
+            digest.update( block )
+    return digest.hexdigest()
+
+# Files are considered the same if the sizes and modification times match
+# (shutil.copy2 preserves the time, to the nanosecond), or with useHash, if
+# the contents match.  A destination time with no fraction of a second is
+# from a volume that can't store one (FAT keeps 2 second times), so then
+# the times only need to be within 2 seconds.
+def sameFile( srcEntry, destEntry, useHash ):
+    srcStat, destStat = srcEntry.stat(), destEntry.stat()
+    if srcStat.st_size != destStat.st_size:
+        return False
+    if useHash:
+        return fileDigest( srcEntry.path ) == fileDigest( destEntry.path )
+    if srcStat.st_mtime_ns == destStat.st_mtime_ns:
+        return True
+    return destStat.st_mtime_ns % 10**9 == 0 and abs( srcStat.st_mtime_ns - destStat.st_mtime_ns ) < 2 * 10**9
+
+#
+# Bring destDir up to date with srcDir, copying only new and changed files
+# and removing anything no longer in the source (except keepNames at the top
+# level) or that matches an ignore pattern.  Nothing is written if the
+# trees already match.
+# Returns the number of files (copied, removed).
+#
+def syncTree( srcDir, destDir, useHash=False, keepNames=(), linkMode='copy', ignore=() ):
+    copied = removed = 0
+    if not os.path.isdir( destDir ):
+        if os.path.lexists( destDir ):
+            removePath( destDir )
+        os.makedirs( destDir )
+
+    destEntries = {e.name: e for e in os.scandir( destDir )}
+    for src in os.scandir( srcDir ):
+        if isIgnored( src.name, ignore ):
+            continue
+        dest = destEntries.pop( src.name, None )
+        destPath = os.path.join( destDir, src.name )
+        destIsDir = dest is not None and dest.is_dir( follow_symlinks=False )
+        if src.is_dir():
+            if dest is not None and not destIsDir:
+                removePath( destPath )
+                removed += 1
+            subCopied, subRemoved = syncTree( src.path, destPath, useHash, (), linkMode, ignore )
+            copied += subCopied
+            removed += subRemoved
+        else:
+            if destIsDir:
+                removePath( destPath )
+                removed += 1
+                dest = None
+            if dest is None or not sameFile( src, dest, useHash ):
+                if dest is not None:
+                    removePath( destPath )
+                linkFile( src.path, destPath, linkMode )
+                copied += 1
+
+    for name, dest in destEntries.items():
+        if name not in keepNames:
+            removePath( dest.path )
+            removed += 1
+    return copied, removed
+
+#
+# Ways of putting the panel files in the install location (--link-mode).
+# Hard links and reflinks (copy-on-write clones) need the source and the
+# install location on the same volume; where they aren't possible, the
+# files are copied instead.  A symlinked panel is a real folder holding a
+# link to each top-level entry of the source, so files written into the
+# install location (the .debug file) don't end up in the source tree.
+#
+linkModes = ('copy', 'hardlink', 'reflink', 'symlink')
+linkVerbs = {'copy': "Copying", 'hardlink': "Hard linking", 'reflink': "Cloning", 'symlink': "Linking"}
+
+# (link mode, source volume, destination volume) found not to work
+unsupportedLinks = set()
+linkLock = threading.Lock()
+
+# Make destPath a copy-on-write clone of srcPath (raises OSError if the
+# filesystem can't).  On Linux, copy_file_range is tried if FICLONE isn't
+# supported; some filesystems share the data for it too, and otherwise it
+# at least copies without the data passing through Python.
+def cloneFile( srcPath, destPath ):
+    if sys.platform.startswith( 'linux' ):
+        import fcntl
+        FICLONE = 0x40049409
+        with open( srcPath, 'rb' ) as src, open( destPath, 'wb' ) as dest:
+            try:
+                fcntl.ioctl( dest.fileno(), FICLONE, src.fileno() )
+            except OSError:
+                if not hasattr( os, 'copy_file_range' ):
+                    raise
+                remaining = os.fstat( src.fileno() ).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range( src.fileno(), dest.fileno(), remaining )
+                    if copied == 0:
+                        break
+                    remaining -= copied
+    elif sys.platform == 'darwin':
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL( ctypes.util.find_library( 'c' ), use_errno=True )
+        if libc.clonefile( os.fsencode( srcPath ), os.fsencode( destPath ), 0 ) != 0:
+            cloneErrno = ctypes.get_errno()
+            raise OSError( cloneErrno, os.strerror( cloneErrno ), srcPath )
+    else:
+        raise OSError( errno.ENOTSUP, "Reflinks aren't supported on %s" % sys.platform, srcPath )
+    shutil.copystat( srcPath, destPath )
+
+# Put srcPath at destPath with a hard link or reflink, falling back to a copy.
+# Windows won't delete a read-only file, and unlocking a hard link unlocks
+# the source too, so read-only (Perforce locked) files are copied there.
+def linkFile( srcPath, destPath, linkMode='copy' ):
+    if linkMode == 'hardlink' and sys.platform == 'win32' and not os.stat( srcPath ).st_mode & stat.S_IWRITE:
+        linkMode = 'copy'
+    if linkMode in ('hardlink', 'reflink'):
+        volumes = (linkMode, os.stat( srcPath ).st_dev, os.stat( os.path.dirname( destPath ) ).st_dev)
+        if volumes not in unsupportedLinks:
+            try:
+                if linkMode == 'hardlink':
+                    os.link( srcPath, destPath )
+                else:
+                    cloneFile( srcPath, destPath )
+                return destPath
+            except OSError as linkErr:
+                with linkLock:
+                    if volumes not in unsupportedLinks:
+                        unsupportedLinks.add( volumes )
+                        print( "# Unable to %s into %s (%s), copying instead"
+                               % (linkMode, os.path.dirname( destPath ), linkErr.strerror) )
+                if os.path.lexists( destPath ):
+                    os.remove( destPath )
+    return shutil.copy2( srcPath, destPath )
+
+#
+# For --link-mode symlink, bring destDir up to date with a link to each
+# top-level entry in srcDir (see linkModes).  Returns the number of
+# (linked, removed) entries.
+#
+def syncLinks( srcDir, destDir, keepNames=(), ignore=() ):
+    linked = removed = 0
+    if not os.path.isdir( destDir ) or os.path.islink( destDir ):
+        if os.path.lexists( destDir ):
+            removePath( destDir )
+        os.makedirs( destDir )
+
+    destEntries = {e.name: e for e in os.scandir( destDir )}
+    for src in os.scandir( srcDir ):
+        if isIgnored( src.name, ignore ):
+            continue    # (Only at the top; the linked folders show everything in them)
+        dest = destEntries.pop( src.name, None )
+        if dest is not None:
+            if dest.is_symlink() and os.readlink( dest.path ) == src.path:
+                continue
+            removePath( dest.path )
+            removed += 1
+        os.symlink( src.path, os.path.join( destDir, src.name ), target_is_directory=src.is_dir() )
+        linked += 1
+
+    for name, dest in destEntries.items():
+        if name not in keepNames:
+            removePath( dest.path )
+            removed += 1
+    return linked, removed
+
+# Fill a new destDir from srcDir (symlinks fall back to copies if they can't be made)
+def copyTree( srcDir, destDir, linkMode='copy', ignore=() ):
+    if linkMode == 'symlink':
+        try:
+            syncLinks( srcDir, destDir, (), ignore )
+            return
+        except OSError as linkErr:
+            print( "# Unable to symlink %s (%s), copying instead" % (srcDir, linkErr.strerror) )
+            removePath( destDir )
+    shutil.copytree( srcDir, destDir, copy_function=lambda src, dest: linkFile( src, dest, linkMode ),
+                     ignore=shutil.ignore_patterns( *ignore ) if ignore else None )
+
+# Copy srcPath to each of destPaths, reading it only once
+def copyFileTo( srcPath, destPaths ):
+    with open( srcPath, 'rb' ) as src:
+        destFiles = []
+        try:
+            for destPath in destPaths:
+                destFiles.append( open( destPath, 'wb' ) )
+            for block in iter( lambda: src.read( 1024 * 1024 ), b'' ):
+                for dest in destFiles:
+                    dest.write( block )
+        finally:
+            for dest in destFiles:
+                dest.close()
+    for destPath in destPaths:
+        shutil.copystat( srcPath, destPath )
+
+# Like shutil.copytree, but into several new folders at once (see copyFileTo)
+def copyTreeTo( srcDir, destDirs, ignore=() ):
+    for destDir in destDirs:
+        os.makedirs( destDir )
+    for entry in os.scandir( srcDir ):
+        if isIgnored( entry.name, ignore ):
+            continue
+        destPaths = [os.path.join( destDir, entry.name ) for destDir in destDirs]
+        if entry.is_dir():
+            copyTreeTo( entry.path, destPaths, ignore )
+        else:
+            copyFileTo( entry.path, destPaths )
+    for destDir in destDirs:
+        shutil.copystat( srcDir, destDir )
+
+# Panel files in a fixed order (sorted by name within each folder), as
+# (archive name, file path) pairs.  Folders are listed as they're reached
+# rather than collecting the whole tree up front.
+def walkPanelFiles( root, relDir="", ignore=() ):
+    for entry in sorted( os.scandir( os.path.join( root, relDir ) ), key=lambda e: e.name ):
+        if isIgnored( entry.name, ignore ):
+            continue
+        relName = relDir + "/" + entry.name if relDir else entry.name
+        if entry.is_dir():
+            yield from walkPanelFiles( root, relName, ignore )
+        else:
+            yield relName, entry.path
+
+#
+# Writes panel ZIP archives.  Members are added in walkPanelFiles order
+# with a fixed timestamp and permissions, so the same sources always give
+# a byte-identical archive.  Files already in a compressed format are
+# stored as-is.  Other files up to bufferedMemberSize are deflated on a
+# pool of threads (zlib releases the GIL), a few at a time, and written in
+# order as they finish.  Larger files are read in blocks, which are
+# deflated on the same pool (see packBlock).
+#
+# The archive is written to path + ".tmp" and only renamed to path once
+# it's complete, so a failure leaves the previous archive in place (and
+# nothing half written for anyone reading it).
+#
+class PanelZipWriter:
+    STORED, DEFLATED = 0, 8                # ZIP compression methods
+    storedExtensions = {'.png', '.gif', '.jpg', '.jpeg', '.psd', '.zip', '.zxp', '.gz',
+                        '.woff', '.woff2', '.mp3', '.mp4', '.m4a', '.webp'}
+    bufferedMemberSize = 8 * 1024 * 1024
+    blockSize = 1024 * 1024
+    dosTime, dosDate = 0, (1 << 5) | 1      # 1980-01-01 00:00:00
+    versionMadeBy = (3 << 8) | 20           # Unix, so the permissions below are used
+    fileAttributes = (stat.S_IFREG | 0o644) << 16
+
+    def __init__(self, path, level=6, workers=None):
+        self.path = path
+        self.file = open( path + ".tmp", 'wb' )
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        self.centralDirectory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType:
+            self.discard()
+        else:
+            self.close()
+
+    # Give up on the archive, leaving whatever was at path before
+    def discard(self):
+        self.file.close()
+        if os.path.exists( self.file.name ):
+            os.remove( self.file.name )
+
+    def compressMethod(self, filePath):
+        stored = (self.level == 0) or (os.path.splitext( filePath )[1].lower() in self.storedExtensions)
+        return self.STORED if stored else self.DEFLATED
+
+    def compressor(self):
+        import zlib
+        return zlib.compressobj( self.level, zlib.DEFLATED, -15 )
+
+    # Read and compress one file; runs on the worker threads
+    def packMember(self, filePath, method):
+        with open( filePath, 'rb' ) as f:
+            return self.packData( f.read(), method )
+
+    def packData(self, data, method):
+        import zlib
+        crc = zlib.crc32( data )
+        if method == self.DEFLATED and data:
+            compressor = self.compressor()
+            packed = compressor.compress( data ) + compressor.flush()
+            if len(packed) < len(data):
+                return method, crc, len(data), packed
+        return self.STORED, crc, len(data), data
+
+    def localHeader(self, name, method, crc, packedSize, size):
+        import struct
+        flags = 0 if name.isascii() else 0x800
+        encodedName = name.encode( 'utf-8' )
+        return struct.pack( '<IHHHHHIIIHH', 0x04034b50, 20, flags, method, self.dosTime, self.dosDate,
+                            crc, packedSize, size, len(encodedName), 0 ) + encodedName
+
+    def addMember(self, name, method, crc, size, packed):
+        offset = self.file.tell()
+        self.file.write( self.localHeader( name, method, crc, len(packed), size ) )
+        self.file.write( packed )
+        self.centralDirectory.append( (name, method, crc, len(packed), size, offset) )
+
+    # A member that's already in memory
+    def addData(self, name, data, method=DEFLATED):
+        self.addMember( name, *self.packData( data, method ) )
+
+    # Deflate one block of a large file.  Each block is primed with the end
+    # of the one before (as pigz does), and all but the last end with a sync
+    # flush, so the blocks join up into a single deflate stream.
+    def packBlock(self, block, previous, last):
+        import zlib
+        if previous:
+            compressor = zlib.compressobj( self.level, zlib.DEFLATED, -15, zdict=previous )
+        else:
+            compressor = self.compressor()
+        return compressor.compress( block ) + compressor.flush( zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH )
+
+    # Large files are written in blocks, then the header is patched with the sizes
+    def addStreamedMember(self, name, filePath, method, pool):
+        import zlib
+        offset = self.file.tell()
+        header = self.localHeader( name, method, 0, 0, 0 )
+        self.file.write( header )
+        pending = collections.deque()
+        crc = size = packedSize = 0
+        def writeBlock( block ):
+            nonlocal packedSize
+            packedSize += len(block)
+            self.file.write( block )
+        with open( filePath, 'rb' ) as f:
+            previous = b''
+            block = f.read( self.blockSize )
+            while True:
+                nextBlock = f.read( self.blockSize ) if block else b''
+                crc = zlib.crc32( block, crc )
+                size += len(block)
+                if method == self.DEFLATED:
+                    pending.append( pool.submit( self.packBlock, block, previous[-32768:], not nextBlock ) )
+                    # As in writeTree, only a few blocks are held at a time
+                    while len(pending) > self.workers * 2 or (pending and pending[0].done()):
+                        writeBlock( pending.popleft().result() )
+                else:
+                    writeBlock( block )
+                if not nextBlock:
+                    break
+                previous, block = block, nextBlock
+        while pending:
+            writeBlock( pending.popleft().result() )
+        endOffset = self.file.tell()
+        self.file.seek( offset )
+        self.file.write( self.localHeader( name, method, crc, packedSize, size ) )
+        self.file.seek( endOffset )
+        self.centralDirectory.append( (name, method, crc, packedSize, size, offset) )
+
+    def writeTree(self, root, ignore=()):
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor( max_workers=self.workers ) as pool:
+            for name, filePath in walkPanelFiles( root, ignore=ignore ):
+                method = self.compressMethod( filePath )
+                if os.path.getsize( filePath ) > self.bufferedMemberSize:
+                    while pending:
+                        self.addMember( pending[0][0], *pending.popleft()[1].result() )
+                    self.addStreamedMember( name, filePath, method, pool )
+                    continue
+                pending.append( (name, pool.submit( self.packMember, filePath, method )) )
+                # Keep a bounded number of compressed files in memory
+                while len(pending) > self.workers * 2 or (pending and pending[0][1].done()):
+                    self.addMember( pending[0][0], *pending.popleft()[1].result() )
+            while pending:
+                self.addMember( pending[0][0], *pending.popleft()[1].result() )
+
+    def close(self):
+        import struct, zipfile
+        if self.file.closed:
+            return
+        directoryOffset = self.file.tell()
+        if len(self.centralDirectory) > 0xffff or directoryOffset > 0xffffffff:
+            self.discard()
+            raise zipfile.LargeZipFile( "Panel archive needs ZIP64: %s" % self.path )
+        for name, method, crc, packedSize, size, offset in self.centralDirectory:
+            flags = 0 if name.isascii() else 0x800
+            encodedName = name.encode( 'utf-8' )
+            self.file.write( struct.pack( '<IHHHHHHIIIHHHHHII', 0x02014b50, self.versionMadeBy, 20, flags,
+                                          method, self.dosTime, self.dosDate, crc, packedSize, size,
+                                          len(encodedName), 0, 0, 0, 0, self.fileAttributes, offset ) )
+            self.file.write( encodedName )
+        directorySize = self.file.tell() - directoryOffset
+        self.file.write( struct.pack( '<IHHHHIIH', 0x06054b50, 0, 0, len(self.centralDirectory),
+                                      len(self.centralDirectory), directorySize, directoryOffset, 0 ) )
+        self.file.close()
+        os.replace( self.file.name, self.path )
+
+#
+# Remembers what went into each archive in Targets/, so -z and -p can skip
+# panels whose sources haven't changed.  An archive's key is a hash of the
+# panel's file names and contents plus the settings used to build it.  The
+# index (Targets/buildIndex.json) also keeps each source file's digest by
+# size and mtime, so checking an unchanged panel doesn't re-read it.
+#
+class BuildCache:
+    def __init__(self, targetFolder):
+        self.indexFile = os.path.join( targetFolder, "buildIndex.json" )
+        try:
+            with open( self.indexFile ) as f:
+                index = json.load( f )
+        except (OSError, IOError, ValueError):
+            index = {}
+        self.artifacts = index.get( 'artifacts', {} )
+        self.digests = index.get( 'digests', {} )
+        self.dirty = False
+
+    def fileDigest(self, path):
+        fileStat = os.stat( path )
+        stamp = [fileStat.st_size, fileStat.st_mtime_ns]
+        known = self.digests.get( path )
+        if known and known[0] == stamp:
+            return known[1]
+        digest = fileDigest( path )
+        self.digests[path] = [stamp, digest]
+        self.dirty = True
+        return digest
+
+    def buildKey(self, root, *settings, ignore=()):
+        key = hashlib.sha1()
+        for setting in settings:
+            key.update( repr(setting).encode( 'utf-8' ) + b'\0' )
+        for name, filePath in walkPanelFiles( root, ignore=ignore ):
+            key.update( name.encode( 'utf-8' ) + b'\0' + self.fileDigest( filePath ).encode( 'ascii' ) + b'\0' )
+        return key.hexdigest()
+
+    # The archive must also be the same file recorded when it was built
+    def isCurrent(self, artifact, key):
+        entry = self.artifacts.get( os.path.basename( artifact ) )
+        if not entry or entry['key'] != key or not os.path.exists( artifact ):
+            return False
+        fileStat = os.stat( artifact )
+        return entry['stamp'] == [fileStat.st_size, fileStat.st_mtime_ns]
+
+    def record(self, artifact, key):
+        fileStat = os.stat( artifact )
+        self.artifacts[os.path.basename( artifact )] = {'key': key, 'stamp': [fileStat.st_size, fileStat.st_mtime_ns]}
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        with open( self.indexFile, 'w' ) as f:
+            json.dump( {'artifacts': self.artifacts, 'digests': self.digests}, f )
+        self.dirty = False
+
+#
+# Unpack a packaged panel into destFolder.  Members are streamed to disk a
+# block at a time, folders are created as needed (whether or not the
+# archive lists them), and permissions and timestamps are restored.
+# Members that would land outside destFolder stop the install.
+#
+# Where a member named in an archive goes in destRoot (which must be a real path)
+def memberPath( destRoot, name, zipPath ):
+    target = os.path.realpath( os.path.join( destRoot, name ) )
+    if os.path.commonpath( [destRoot, target] ) != destRoot:
+        raise PanelError( "%s: %s is outside the panel folder" % (zipPath, name) )
+    return target
+
+def extractPackage( zipPath, destFolder ):
+    import zipfile
+    destRoot = os.path.realpath( destFolder )
+    os.makedirs( destRoot, exist_ok=True )
+    with zipfile.ZipFile( zipPath ) as zps:
+        for info in zps.infolist():
+            target = memberPath( destRoot, info.filename, zipPath )
+
+            if info.is_dir():
+                os.makedirs( target, exist_ok=True )
+                continue
+            os.makedirs( os.path.dirname( target ), exist_ok=True )
+            with zps.open( info ) as src, open( target, 'wb' ) as dest:
+                shutil.copyfileobj( src, dest, 1024 * 1024 )
+
+            mode = (info.external_attr >> 16) & 0o777
+            if (info.create_system == 3) and mode:     # Unix permissions
+                os.chmod( target, mode | stat.S_IRUSR | stat.S_IWUSR )
+            timestamp = datetime.datetime( *info.date_time ).timestamp()
+            os.utime( target, (timestamp, timestamp) )
+
+#
+# Delta packages hold just what changed between two versions of a panel:
+# a delta.json listing the files added, changed and deleted (with SHA-1
+# hashes of the old and new contents, and the two ExtensionBundleVersions)
+# and the new contents of the added and changed files under files/.
+#
+# They're made from two versions of a panel, each either a source folder
+# or an archive (made by -z or -p; a signed package's signature files are
+# carried along like any other).  installDelta checks that the installed
+# panel is the base version, with the changed and deleted files as they
+# were, then stages the new version with hard links to the files it
+# shares with the installed one, and swaps it in like any other deploy.
+# So the time it takes depends on how much changed, not the panel's size.
+#
+deltaFormat = 1
+
+# The files of a panel in a folder or an archive, by archive name
+class PanelContents:
+    def __init__(self, location, ignore=()):
+        self.location = location
+        if os.path.isdir( location ):
+            self.archive = None
+            self.files = dict( walkPanelFiles( location, ignore=ignore ) )
+        else:
+            import zipfile
+            self.archive = zipfile.ZipFile( location )
+            self.files = {info.filename: info for info in self.archive.infolist() if not info.is_dir()}
+
+    def open(self, name):
+        return self.archive.open( self.files[name] ) if self.archive else open( self.files[name], 'rb' )
+
+    def digest(self, name):
+        digest = hashlib.sha1()
+        with self.open( name ) as f:
+            for block in iter( lambda: f.read( 1024 * 1024 ), b'' ):
+                digest.update( block )
+        return digest.hexdigest()
+
+    def digests(self):
+        return {name: self.digest( name ) for name in self.files}
+
+    def manifest(self):
+        if "CSXS/manifest.xml" not in self.files:
+            raise PanelError( "%s has no CSXS/manifest.xml" % self.location )
+        with self.open( "CSXS/manifest.xml" ) as f:
+            manifest = ExtensionManifest.parse( f )
+        if not manifest:
+            raise PanelError( "No ExtensionManifest in %s" % self.location )
+        manifest.path = os.path.join( self.location, "CSXS", "manifest.xml" )
+        return manifest
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+
+# Write the delta from basePath to newPath (see deltaFormat) to deltaPath
+# and return its delta.json contents
+def makeDelta( basePath, newPath, deltaPath, ignore=(), level=6 ):
+    base, new = PanelContents( basePath, ignore ), PanelContents( newPath, ignore )
+    try:
+        baseManifest, newManifest = base.manifest(), new.manifest()
+        if baseManifest.bundleID != newManifest.bundleID:
+            raise PanelError( "%s is %s, but %s is %s" % (basePath, baseManifest.bundleID,
+                                                           newPath, newManifest.bundleID) )
+        baseDigests, newDigests = base.digests(), new.digests()
+        delta = {'format': deltaFormat, 'bundleID': newManifest.bundleID,
+                 'baseVersion': baseManifest.bundleVersion, 'version': newManifest.bundleVersion,
+                 'added': {name: digest for name, digest in newDigests.items() if name not in baseDigests},
+                 'changed': {name: {'from': baseDigests[name], 'to': digest} for name, digest in newDigests.items()
+                             if name in baseDigests and baseDigests[name] != digest},
+                 'deleted': {name: digest for name, digest in baseDigests.items() if name not in newDigests}}
+
+        with PanelZipWriter( deltaPath, level ) as zf:
+            zf.addData( "delta.json", json.dumps( delta, indent=1, sort_keys=True ).encode( 'utf-8' ) )
+            for name in sorted( list( delta['added'] ) + list( delta['changed'] ) ):
+                with new.open( name ) as f:
+                    zf.addData( "files/" + name, f.read(), zf.compressMethod( name ) )
+        return delta
+    finally:
+        base.close()
+        new.close()
+
+#
+# Apply a delta package to the panel installed in config.destPath (see
+# deltaFormat).  Raises PanelError, leaving the installed panel alone, if
+# it isn't the delta's base version or its files don't match.
+#
+def installDelta( deltaPath, config ):
+    import zipfile
+    with zipfile.ZipFile( deltaPath ) as zf:
+        try:
+            delta = json.loads( zf.read( "delta.json" ) )
+        except (KeyError, ValueError):
+            raise PanelError( "%s isn't a delta package" % deltaPath )
+        if delta.get( 'format' ) != deltaFormat:
+            raise PanelError( "%s is a newer delta format (%s)" % (deltaPath, delta.get( 'format' )) )
+
+        # The bundle ID names the folder to update, so it must be a plain ID,
+        # and the one in the installed manifest (the folder deploy replaces)
+        if not idPattern.match( str( delta.get( 'bundleID' ) ) ):
+            raise PanelError( "%s has a bad bundle ID: %r" % (deltaPath, delta.get( 'bundleID' )) )
+        destPath = config.destPath + delta['bundleID']
+        installed = PanelContents( destPath ) if os.path.isdir( destPath ) else None
+        if not installed:
+            raise PanelError( "%s isn't installed in %s" % (delta['bundleID'], config.destPath) )
+        manifest = installed.manifest()
+        if manifest.bundleID != delta['bundleID']:
+            raise PanelError( "%s holds %s, not %s" % (destPath, manifest.bundleID, delta['bundleID']) )
+        if manifest.bundleVersion == delta['version'] and manifest.bundleVersion != delta['baseVersion']:
+            print( "# %s %s is already installed" % (delta['bundleID'], delta['version']) )
+            return
+        if manifest.bundleVersion != delta['baseVersion']:
+            raise PanelError( "%s is installed at version %s, but %s is from version %s"
+                              % (delta['bundleID'], manifest.bundleVersion, deltaPath, delta['baseVersion']) )
+        for name, digest in list( delta['deleted'].items() ) + [(n, c['from']) for n, c in delta['changed'].items()]:
+            if name not in installed.files or installed.digest( name ) != digest:
+                raise PanelError( "%s doesn't match version %s of %s, so the delta can't be applied"
+                                  % (name, delta['baseVersion'], delta['bundleID']) )
+
+        print( "# Updating %s from %s to %s: %d added, %d changed, %d deleted"
+               % (delta['bundleID'], delta['baseVersion'], delta['version'],
+                  len(delta['added']), len(delta['changed']), len(delta['deleted'])) )
+
+        def populate( stagePath ):
+            # The files carried over are linked from the installed version (the
+            # .debug file too), and the rest are written as new files, so the
+            # installed version stays intact as the previous one
+            copyTree( destPath, stagePath, 'hardlink' )
+            stageRoot = os.path.realpath( stagePath )
+            for name in delta['deleted']:
+                os.remove( memberPath( stageRoot, name, deltaPath ) )
+            for name, digest in (list( delta['added'].items() ) +
+                                 [(n, c['to']) for n, c in delta['changed'].items()]):
+                target = memberPath( stageRoot, name, deltaPath )
+                if os.path.lexists( target ):
+                    os.remove( target )
+                os.makedirs( os.path.dirname( target ), exist_ok=True )
+                written = hashlib.sha1()
+                with zf.open( "files/" + name ) as src, open( target, 'wb' ) as dest:
+                    for block in iter( lambda: src.read( 1024 * 1024 ), b'' ):
+                        written.update( block )
+                        dest.write( block )
+                if written.hexdigest() != digest:
+                    raise PanelError( "%s: files/%s is damaged" % (deltaPath, name) )
+
+        Panel( manifest, config ).deploy( populate )
+
+# Size and mtime of every file under the roots (None for folders), by path
+def scanTree(roots):
+    snapshot = {}
+    def scanFolder(folder):
+        for entry in os.scandir( folder ):
+            if entry.is_dir( follow_symlinks=False ):
+                snapshot[entry.path] = None
+                scanFolder( entry.path )
+            else:
+                entryStat = entry.stat()
+                snapshot[entry.path] = (entryStat.st_size, entryStat.st_mtime_ns)
+    for root in roots:
+        scanFolder( root )
+    return snapshot
+
+# Paths added, removed or changed between two scanTree snapshots
+def changedPaths(oldSnapshot, newSnapshot):
+    return {path for path in oldSnapshot.keys() | newSnapshot.keys()
+            if oldSnapshot.get( path, 0 ) != newSnapshot.get( path, 0 )}
+
+#
+# Watchers for --watch.  changes(timeout) waits up to timeout seconds (or
+# until something happens, if timeout is None) and returns the set of
+# paths under the watched folders that were created, changed or removed.
+# Linux uses inotify and macOS FSEvents; elsewhere (or if those can't be
+# set up) the folders are polled.
+#
+class PollingWatcher:
+    interval = 0.25
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.snapshot = scanTree( roots )
+
+    def changes(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep( self.interval if deadline is None else max( 0, min( self.interval, deadline - time.monotonic() ) ) )
+            snapshot = scanTree( self.roots )
+            changed = changedPaths( self.snapshot, snapshot )
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+# Linux inotify, through libc, watching every folder under the roots
+class InotifyWatcher:
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_ISDIR = 0x40000000
+    eventMask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, roots):
+        import ctypes, struct
+        self.ctypes = ctypes
+        self.eventHeader = struct.Struct( 'iIII' )
+        self.libc = ctypes.CDLL( None, use_errno=True )
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError( ctypes.get_errno(), "inotify_init failed" )
+        self.folders = {}
+        for root in roots:
+            self.watchTree( root )
+
+    def watchTree(self, folder):
+        wd = self.libc.inotify_add_watch( self.fd, os.fsencode( folder ), self.eventMask )
+        if wd < 0:
+            return
+        self.folders[wd] = folder
+        for entry in os.scandir( folder ):
+            if entry.is_dir( follow_symlinks=False ):
+                self.watchTree( entry.path )
+
+    def changes(self, timeout=None):
+        import select
+        changed = set()
+        if not select.select( [self.fd], [], [], timeout )[0]:
+            return changed
+        data = os.read( self.fd, 64 * 1024 )
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, nameLength = self.eventHeader.unpack_from( data, offset )
+            offset += self.eventHeader.size
+            name = os.fsdecode( data[offset:offset + nameLength].rstrip( b'\0' ) )
+            offset += nameLength
+            if wd not in self.folders or not name:
+                continue
+            path = os.path.join( self.folders[wd], name )
+            changed.add( path )
+            # New folders need their own watches
+            if (mask & self.IN_ISDIR) and (mask & (self.IN_CREATE | self.IN_MOVED_TO)) and os.path.isdir( path ):
+                self.watchTree( path )
+                for root, dirs, files in os.walk( path ):
+                    changed.update( os.path.join( root, f ) for f in files )
+        return changed
+
+#
+# macOS FSEvents, through CoreServices: one stream with per-file events for
+# all the roots, delivered on a dispatch queue.  FSEvents reports real
+# paths, so they're mapped back to the roots as given.
+#
+class FSEventsWatcher:
+    kCFStringEncodingUTF8 = 0x08000100
+    kFSEventStreamEventIdSinceNow = 0xFFFFFFFFFFFFFFFF
+    kFSEventStreamCreateFlagNoDefer, kFSEventStreamCreateFlagFileEvents = 0x2, 0x10
+    latency = 0.05
+
+    def __init__(self, roots):
+        import ctypes, ctypes.util, queue
+        self.events = queue.Queue()
+        self.realRoots = [(os.path.join( os.path.realpath( root ), "" ), os.path.join( os.path.normpath( root ), "" ))
+                          for root in roots]
+        coreFoundation = ctypes.CDLL( ctypes.util.find_library( 'CoreFoundation' ) )
+        coreServices = ctypes.CDLL( ctypes.util.find_library( 'CoreServices' ) )
+        system = ctypes.CDLL( ctypes.util.find_library( 'System' ) )
+        callbackType = ctypes.CFUNCTYPE( None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+                                         ctypes.POINTER( ctypes.c_char_p ), ctypes.POINTER( ctypes.c_uint32 ),
+                                         ctypes.POINTER( ctypes.c_uint64 ) )
+        coreFoundation.CFStringCreateWithCString.restype = ctypes.c_void_p
+        coreFoundation.CFStringCreateWithCString.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint32]
+        coreFoundation.CFArrayCreate.restype = ctypes.c_void_p
+        coreFoundation.CFArrayCreate.argtypes = [ctypes.c_void_p, ctypes.POINTER( ctypes.c_void_p ), ctypes.c_long,
+                                                 ctypes.c_void_p]
+        coreServices.FSEventStreamCreate.restype = ctypes.c_void_p
+        coreServices.FSEventStreamCreate.argtypes = [ctypes.c_void_p, callbackType, ctypes.c_void_p, ctypes.c_void_p,
+                                                     ctypes.c_uint64, ctypes.c_double, ctypes.c_uint32]
+        coreServices.FSEventStreamSetDispatchQueue.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        coreServices.FSEventStreamStart.restype = ctypes.c_bool
+        coreServices.FSEventStreamStart.argtypes = [ctypes.c_void_p]
+        system.dispatch_queue_create.restype = ctypes.c_void_p
+        system.dispatch_queue_create.argtypes = [ctypes.c_char_p, ctypes.c_void_p]
+
+        rootStrings = [coreFoundation.CFStringCreateWithCString( None, os.fsencode( real ), self.kCFStringEncodingUTF8 )
+                       for real, root in self.realRoots]
+        rootArray = coreFoundation.CFArrayCreate( None, (ctypes.c_void_p * len(rootStrings))( *rootStrings ),
+                                                  len(rootStrings),
+                                                  ctypes.addressof( ctypes.c_void_p.in_dll( coreFoundation,
+                                                                                           'kCFTypeArrayCallBacks' ) ) )
+        # Kept, as the stream calls it for as long as the watcher is around
+        self.callback = callbackType( self.onEvents )
+        self.stream = coreServices.FSEventStreamCreate( None, self.callback, None, rootArray,
+                                                        self.kFSEventStreamEventIdSinceNow, self.latency,
+                                                        self.kFSEventStreamCreateFlagNoDefer |
+                                                        self.kFSEventStreamCreateFlagFileEvents )
+        if not self.stream:
+            raise OSError( "FSEventStreamCreate failed" )
+        coreServices.FSEventStreamSetDispatchQueue( self.stream, system.dispatch_queue_create( b"panelTools.watch", None ) )
+        if not coreServices.FSEventStreamStart( self.stream ):
+            raise OSError( "FSEventStreamStart failed" )
+
+    # Runs on the dispatch queue's thread
+    def onEvents(self, stream, info, count, paths, flags, ids):
+        changed = set()
+        for i in range( count ):
+            path = os.fsdecode( paths[i] )
+            for real, root in self.realRoots:
+                if path.startswith( real ):
+                    path = root + path[len(real):]
+                    break
+            changed.add( path )
+        self.events.put( changed )
+
+    def changes(self, timeout=None):
+        import queue
+        try:
+            changed = set( self.events.get( timeout=timeout ) )
+        except queue.Empty:
+            return set()
+        while True:
+            try:
+                changed |= self.events.get_nowait()
+            except queue.Empty:
+                return changed
+
+def makeWatcher(roots):
+    try:
+        if sys.platform.startswith('linux'):
+            return InotifyWatcher( roots )
+        if sys.platform == 'darwin':
+            return FSEventsWatcher( roots )
+    except (OSError, AttributeError, TypeError):
+        pass
+    return PollingWatcher( roots )
+
+#
+# Wall time, file count and bytes for each step of a run.
+# Per-panel steps also note the panel; the files and bytes are measured
+# from a folder the step reads or writes, and only when timings are wanted.
+#
+class Timings:
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.records = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def start(self, name, panel=None):
+        with self.lock:
+            thread = self.threads.setdefault( threading.get_ident(), len(self.threads) + 1 )
+        return {'name': name, 'panel': panel, 'start': time.perf_counter() - self.origin,
+                'end': None, 'files': 0, 'bytes': 0, 'thread': thread}
+
+    def finish(self, record):
+        record['end'] = time.perf_counter() - self.origin
+        with self.lock:
+            self.records.append( record )
+
+    # The files and bytes are counted first, so counting isn't part of the time
+    class Phase:
+        def __init__(self, timings, name, panel, measurePath, ignore):
+            self.timings, self.name, self.panel = timings, name, panel
+            self.measurePath, self.ignore = measurePath, ignore
+
+        def __enter__(self):
+            measured = (measureTree( self.measurePath, self.ignore )
+                        if self.timings.enabled and self.measurePath else (0, 0))
+            self.record = self.timings.start( self.name, self.panel )
+            self.record['files'], self.record['bytes'] = measured
+            return self.record
+
+        def __exit__(self, *excInfo):
+            self.timings.finish( self.record )
+
+    def phase(self, name, panel=None, measurePath=None, ignore=()):
+        return Timings.Phase( self, name, panel, measurePath, ignore )
+
+    def report(self, stream):
+        def rate(record):
+            wall = record['end'] - record['start']
+            return "%8.1f MB/s" % (record['bytes'] / wall / 1e6) if (record['bytes'] and wall > 0) else ""
+
+        # Steps run once per panel are summed up as a whole, then listed per panel
+        steps = collections.OrderedDict()
+        for r in sorted( self.records, key=lambda r: r['start'] ):
+            steps.setdefault( r['name'], [] ).append( r )
+        stream.write( "# %-28s %10s %8s %12s %13s\n" % ("Step", "Time (ms)", "Files", "Bytes", "Throughput") )
+        for name, records in steps.items():
+            total = {'start': min( r['start'] for r in records ), 'end': max( r['end'] for r in records ),
+                     'files': sum( r['files'] for r in records ), 'bytes': sum( r['bytes'] for r in records )}
+            for r in [total] + [r for r in records if r['panel']]:
+                label = name if r is total else "  " + r['panel']
+                stream.write( "# %-28s %10.1f %8d %12d %13s\n" % (label, (r['end'] - r['start']) * 1000,
+                                                                  r['files'], r['bytes'], rate( r )) )
+
+    def save(self, path, fileFormat='json'):
+        if fileFormat == 'trace':
+            data = {'traceEvents': [{'name': r['name'] + (": " + r['panel'] if r['panel'] else ""),
+                                     'cat': r['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': r['thread'],
+                                     'ts': r['start'] * 1e6, 'dur': (r['end'] - r['start']) * 1e6,
+                                     'args': {'files': r['files'], 'bytes': r['bytes']}}
+                                    for r in self.records]}
+        else:
+            data = {'records': [dict( r, wall=r['end'] - r['start'] ) for r in self.records]}
+        with open( path, 'w' ) as f:
+            json.dump( data, f, indent=1 )
+
+    def done(self, printReport, path=None, fileFormat='json'):
+        if printReport:
+            self.report( sys.stderr )
+        if path:
+            self.save( path, fileFormat )
+
+# Number of files and total bytes under a folder (or for one file),
+# leaving out anything matching an ignore pattern
+def measureTree(path, ignore=()):
+    if os.path.isfile( path ):
+        return 1, os.path.getsize( path )
+    files = size = 0
+    for root, dirs, fileNames in os.walk( path ):
+        dirs[:] = [d for d in dirs if not isIgnored( d, ignore )]
+        for f in fileNames:
+            if isIgnored( f, ignore ):
+                continue
+            try:
+                size += os.lstat( os.path.join( root, f ) ).st_size
+                files += 1
+            except OSError:
+                pass
+    return files, size
+
+#
+# Cache folders are renamed into a trash folder next to them (so they're
+# gone from where CEP looks at once), then deleted on a pool of threads
+# while other work carries on.  Anything a previous run didn't finish
+# deleting is picked up too.  Python waits for the pool before exiting;
+# finish() waits for it sooner, and returns the (files, bytes) reclaimed.
+# Call close() instead to leave the deleting to the background.
+#
+class TrashBin:
+    def __init__(self, folder, workers=4):
+        self.folder = folder
+        self.pool = concurrent.futures.ThreadPoolExecutor( max_workers=workers )
+        self.pending = []
+        self.lock = threading.Lock()
+        self.count = 0
+        if os.path.isdir( folder ):
+            for entry in os.scandir( folder ):
+                self.pending.append( self.pool.submit( self.remove, entry.path ) )
+
+    def discard(self, path):
+        # Locked, so a worker can't remove the folder between the two
+        with self.lock:
+            self.count += 1
+            trashPath = os.path.join( self.folder, "%d.%d.%s" % (os.getpid(), self.count, os.path.basename( path )) )
+            os.makedirs( self.folder, exist_ok=True )
+            os.rename( path, trashPath )
+        self.pending.append( self.pool.submit( self.remove, trashPath ) )
+
+    def remove(self, path):
+        files, size = measureTree( path )
+        try:
+            removePath( path )
+        except (OSError, IOError):
+            return 0, 0     # Left for next time
+        with self.lock:
+            try:
+                os.rmdir( self.folder )     # Once it's empty
+            except OSError:
+                pass
+        return files, size
+
+    def close(self):
+        self.pool.shutdown( wait=False )
+
+    def finish(self):
+        self.pool.shutdown( wait=True )
+        results = [f.result() for f in self.pending]
+        self.pending = []
+        return sum( r[0] for r in results ), sum( r[1] for r in results )
+
+#
+# Everything a command needs to know about where panels come from and go
+# to.  srcLocation is the folder holding the panel sources (one folder per
+# panel, each with a CSXS/manifest.xml).  destPath defaults to the
+# platform's extension folder for this user, or all users with allusers.
+#
+class PanelConfig:
+    def __init__(self, srcLocation, destPath=None, allusers=False, cepVersion='10', jobs=1,
+                 zipLevel=6, rebuild=False, password=None, certPath=None, targetFolder=None,
+                 manifestCache=None, timings=None, linkMode='copy', ignore=defaultIgnore,
+                 fileBudget=None, byteBudget=None, clearCache=None):
+        self.srcLocation = os.path.join( os.path.abspath( srcLocation ), "" )
+        if destPath is None:
+            destPaths = defaultDestPaths()
+            if not destPaths:
+                raise PanelError( "No extension folder for %s, a destination must be given" % sys.platform )
+            destPath = destPaths[allusers]
+        self.destPath = os.path.join( os.path.abspath( destPath ), "" )
+        # Only CEP's own extension folders have a cache beside them that
+        # needs clearing; any other folder's neighbours are left alone
+        if clearCache is None:
+            clearCache = isDefaultDestPath( self.destPath )
+        self.clearCache = clearCache
+        self.cepVersion = cepVersion
+        if jobs < 1:
+            raise PanelError( "jobs must be at least 1, not %d" % jobs, 2 )
+        self.jobs = jobs
+        self.zipLevel = zipLevel
+        self.rebuild = rebuild
+        self.password = password
+        # Location of the certificate file used to sign the package.
+        self.certPath = certPath or os.path.join( self.srcLocation, "cert", "panelcert.p12" )
+        self.targetFolder = os.path.join( os.path.abspath( targetFolder or os.path.join( self.srcLocation, "Targets" ) ), "" )
+        self.manifestCache = manifestCache or ManifestCache( os.path.join( self.targetFolder, "manifestCache.json" ) )
+        self.timings = timings or Timings()
+        if linkMode not in linkModes:
+            raise PanelError( "Unknown link mode %r, expected one of %s" % (linkMode, ", ".join( linkModes )), 2 )
+        self.linkMode = linkMode
+        self.ignore = tuple(ignore)
+        # Limits on each panel's size for checkPanels (None for no limit)
+        self.fileBudget = fileBudget
+        self.byteBudget = byteBudget
+        self.debugPorts = None
+        self.buildCache = None
+        self.lock = threading.Lock()
+
+    def getTargetFolder(self):
+        os.makedirs( self.targetFolder, exist_ok=True )
+        return self.targetFolder
+
+    def getBuildCache(self):
+        with self.lock:
+            if self.buildCache is None:
+                self.buildCache = BuildCache( self.getTargetFolder() )
+            return self.buildCache
+
+    # Remote debugger ports, shared with every other destination
+    def getDebugPorts(self):
+        with self.lock:
+            if self.debugPorts is None:
+                self.debugPorts = DebugPorts.open( debugPortsPath() )
+            return self.debugPorts
+
+    # Staging and previous versions of the panels (see Panel.deploy)
+    def deployFolder(self):
+        return os.path.normpath( self.destPath ) + ".deploy" + os.sep
+
+    # Leaving this cache around can cause problems.  None when destPath
+    # isn't a CEP extension folder (see clearCache).
+    def extensionCachePath(self):
+        if not self.clearCache:
+            return None
+        return os.path.normpath( self.destPath + "../cache" )
+
+# For checking manifests (see Panel.problems)
+idPattern = re.compile( r"^[A-Za-z0-9_-]+(\.[A-Za-z0-9_-]+)+$" )
+versionPattern = re.compile( r"^\d+(\.\d+){0,3}$" )
+
+class Panel:
+    #
+    # Pull out the panel ID and name from the manifest
+    #
+    def __init__(self, manifest, config):
+        self.manifest = manifest
+        self.config = config
+        self.fullPanelID = manifest.bundleID or "ERROR_FINDING_ID"
+        self.panelID = self.fullPanelID.split('.')[-1] if '.' in self.fullPanelID else "ERROR_FINDING_ID"
+        self.panelName = manifest.bundleName or self.panelID
+        # (The folder holding CSXS/manifest.xml)
+        self.panelSrcFolder = os.path.basename( os.path.dirname( os.path.dirname( os.path.abspath( manifest.path ) ) ) )
+
+    def srcPath(self):
+        return self.config.srcLocation + self.panelSrcFolder
+
+    def destPath(self):
+        return self.config.destPath + self.fullPanelID
+
+    # Archive built by -z or -p
+    def packagePath(self):
+        return self.config.getTargetFolder() + self.fullPanelID + ".zip"
+
+    #
+    # New versions of a panel are built in a staging folder, then renamed
+    # into place, so Photoshop never sees a partly copied panel.  The
+    # version it replaces is kept for --rollback.  Both live in a folder
+    # next to the extensions folder (on the same volume, so the renames
+    # are cheap, but where CEP won't load them).
+    #
+    def stagePath(self):
+        return self.config.deployFolder() + self.fullPanelID + ".staging"
+
+    def previousPath(self):
+        return self.config.deployFolder() + self.fullPanelID + ".previous"
+
+    # The staging path, with anything left over from an interrupted run removed
+    def newStage(self):
+        stagePath = self.stagePath()
+        if os.path.lexists( stagePath ):
+            removePath( stagePath )
+        os.makedirs( self.config.deployFolder(), exist_ok=True )
+        return stagePath
+
+    # Fill a fresh staging folder with populate(stagePath), then swap it in
+    def deploy(self, populate):
+        stagePath = self.newStage()
+        try:
+            populate( stagePath )
+        except BaseException:
+            if os.path.lexists( stagePath ):
+                removePath( stagePath )
+            raise
+        try:
+            self.swapIn( stagePath )
+        except BaseException:
+            removePath( stagePath )
+            raise
+
+    # Two renames; the installed panel is only missing for the instant
+    # between them.  If the second one fails (files locked on Windows, say),
+    # the installed panel is put back and newPath is left where it was.
+    def swapIn(self, newPath):
+        destPath = self.destPath()
+        previousPath = self.previousPath()
+        if os.path.lexists( destPath ):
+            if os.path.lexists( previousPath ):
+                removePath( previousPath )
+            os.rename( destPath, previousPath )
+        else:
+            os.makedirs( os.path.dirname( destPath ), exist_ok=True )
+            previousPath = None
+        try:
+            os.rename( newPath, destPath )
+        except BaseException:
+            if previousPath:
+                os.rename( previousPath, destPath )
+            raise
+
+    def rollback(self):
+        previousPath = self.previousPath()
+        if not os.path.exists( previousPath ):
+            print( "# No previous version of %s to restore" % self.panelName )
+            return
+        print( "# Restoring the previous version of %s" % self.panelName )
+        stagePath = self.stagePath()
+        if os.path.lexists( stagePath ):
+            removePath( stagePath )
+        os.rename( previousPath, stagePath )
+        try:
+            self.swapIn( stagePath )
+        except BaseException:
+            # Still the previous version, for another try
+            os.rename( stagePath, previousPath )
+            raise
+
+    # Copy (or link, see linkModes) panel source to the deployment folder
+    def copyPanel(self):
+        destPath = self.destPath()
+        print( "# " + linkVerbs[self.config.linkMode] + " " + self.srcPath() + "\n  to " + destPath )
+        self.deploy( lambda stagePath: copyTree( self.srcPath(), stagePath, self.config.linkMode, self.config.ignore ) )
+
+    # Update the deployed panel in place, copying only what changed
+    def syncPanel(self, useHash=False):
+        destPath = self.destPath()
+        if self.config.linkMode == 'symlink':
+            copied, removed = syncLinks( self.srcPath(), destPath, generatedFiles, self.config.ignore )
+        else:
+            copied, removed = syncTree( self.srcPath(), destPath, useHash, generatedFiles, self.config.linkMode,
+                                        self.config.ignore )
+        if (copied or removed):
+            print( "# Synced %s: %d %s, %d removed" % (destPath, copied,
+                   "linked" if self.config.linkMode == 'symlink' else "copied", removed) )
+        else:
+            print( "# %s is up to date" % destPath )
+
+    #
+    # Copy (or remove) just the given source files in the deployed panel.
+    # If the manifest changed, re-read it, clear the panel's CEP cache (CEP
+    # caches what it read from the manifest) and rewrite its .debug file
+    # (unless debugEnabled is None).
+    #
+    def pushChanges(self, changedPaths, debugEnabled=None):
+        srcRoot = self.srcPath()
+        destRoot = self.destPath()
+        linkMode = self.config.linkMode
+        if linkMode == 'symlink':
+            # Edits show through the links; only new and removed top-level entries matter
+            linked, removed = syncLinks( srcRoot, destRoot, generatedFiles, self.config.ignore )
+            if (linked or removed):
+                print( "# Relinked %s: %d linked, %d removed" % (destRoot, linked, removed) )
+        for srcPath in (() if linkMode == 'symlink' else sorted( changedPaths )):
+            relPath = os.path.relpath( srcPath, srcRoot )
+            if any( isIgnored( name, self.config.ignore ) for name in relPath.split( os.sep ) ):
+                continue
+            destPath = os.path.join( destRoot, relPath )
+            if os.path.isdir( srcPath ):
+                syncTree( srcPath, destPath, linkMode=linkMode, ignore=self.config.ignore )
+            elif os.path.isfile( srcPath ):
+                if os.path.isfile( destPath ) and os.path.samefile( srcPath, destPath ):
+                    continue    # Still hard linked, so already up to date
+                if os.path.lexists( destPath ):
+                    removePath( destPath )
+                os.makedirs( os.path.dirname( destPath ), exist_ok=True )
+                linkFile( srcPath, destPath, linkMode )
+            elif os.path.lexists( destPath ):
+                removePath( destPath )
+            else:
+                continue
+            print( "# Updated " + relPath )
+
+        if os.path.join( srcRoot, "CSXS", "manifest.xml" ) in changedPaths:
+            manifest = self.config.manifestCache.load( self.manifest.path )
+            if manifest:
+                self.manifest = manifest
+            self.cleanCache()
+            if debugEnabled is not None:
+                self.setupRemoteDebugFile( debugEnabled )
+                self.config.getDebugPorts().save()
+
+    def cleanCache(self):
+        cleanCaches( [self], self.config )
+
+    #
+    # What's wrong with the panel's manifest (as a list of messages): IDs
+    # that aren't reverse domain names, a version CEP can't compare, and
+    # MainPath or ScriptPath files that aren't in the panel.
+    #
+    def problems(self):
+        manifest = self.manifest
+        found = []
+        if not idPattern.match( manifest.bundleID or "" ):
+            found.append( "ExtensionBundleId %r isn't a valid ID" % manifest.bundleID )
+        if not versionPattern.match( manifest.bundleVersion or "" ):
+            found.append( "ExtensionBundleVersion %r isn't a valid version" % manifest.bundleVersion )
+        if not manifest.extensionIDs:
+            found.append( "No extensions in the ExtensionList" )
+        for extID in manifest.extensionIDs:
+            if not idPattern.match( extID or "" ):
+                found.append( "Extension Id %r isn't a valid ID" % extID )
+        for resource in manifest.mainPaths + manifest.scriptPaths:
+            resourcePath = os.path.join( self.srcPath(), resource.split( "?" )[0] )
+            if not os.path.isfile( resourcePath ):
+                found.append( "%s is missing" % resource )
+            elif isIgnored( os.path.basename( resourcePath ), self.config.ignore ):
+                found.append( "%s matches an ignore pattern" % resource )
+        return found
+
+    # Unlock, then remove the panels
+    def erasePanel(self):
+        destPath = self.destPath()
+        if (os.path.exists( destPath )):
+            print( "# Removing " + destPath )
+            removePath( destPath, removeWorkers )
+
+    # Create the .debug file for enabling the remote debugger
+    def debugFilename(self):
+        return os.path.join( self.destPath(), ".debug" )
+
+    # Setup/remove remote debug config files
+    def createRemoteDebugXML(self):
+        extensionTemplate = """  <Extension Id="%s">
+    <HostList>
+      <Host Name="PHXS" Port="%d"/>
+    </HostList>
+  </Extension>
+"""
+        debugText = """<?xml version="1.0" encoding="UTF-8"?>\n"""
+        debugText += "<ExtensionList>\n"
+        for extName in self.manifest.extensionIDs:
+            portNumber = self.config.getDebugPorts().portFor( extName )
+            debugText += extensionTemplate % (extName, portNumber)
+            print( "# Remote Debug %s at http://localhost:%d" % (extName, portNumber) )
+        debugText += "</ExtensionList>\n"
+        try:
+            # Leave an up to date file alone, so a --sync with no changes writes nothing
+            if os.path.exists( self.debugFilename() ):
+                with open( self.debugFilename() ) as f:
+                    if f.read() == debugText:
+                        return
+            with open( self.debugFilename(), 'w' ) as f:
+                f.write( debugText )
+        except IOError as writeErr:
+            if (writeErr.errno == errno.ENOENT):
+               print( "# Note: Panel %s is not installed" % self.panelName )
+
+    def setupRemoteDebugFile(self, debugEnabled):
+        if debugEnabled:
+            self.createRemoteDebugXML()
+        else:
+            if (os.path.exists( self.debugFilename() )):
+                os.remove( self.debugFilename() )
+                print( "# Removing debug file for %s" % self.panelName )
+
+    #
+    # Create a signed double-clickable install package
+    # There's some more info on self-signing here:
+    # http://forums.adobe.com/message/5714997
+    #
+    def packagePanel(self):
+        import subprocess
+        config = self.config
+        timestampURL = "http://timestamp.digicert.com"
+#        timestampURL = "http://tsa.starfieldtech.com"
+
+        pkgFile = self.packagePath()
+        buildKey = config.getBuildCache().buildKey( self.srcPath(), "package", timestampURL,
+                                                    fileDigest( config.certPath ), ignore=config.ignore )
+        if config.getBuildCache().isCurrent( pkgFile, buildKey ) and not config.rebuild:
+            print( "# Package is up to date: '%s'" % pkgFile )
+            return
+        # Must remove the file first, otherwise contents not updated.
+        if os.path.exists( pkgFile ):
+            os.remove( pkgFile )
+        print( "# Creating package: '%s'" % pkgFile )
+        # ZXPSignCmd signs a whole folder, so leave the ignored files out of a copy of it
+        signPath = self.srcPath()
+        if config.ignore:
+            signPath = config.getTargetFolder() + self.fullPanelID + ".signing"
+            if os.path.lexists( signPath ):
+                removePath( signPath )
+            copyTree( self.srcPath(), signPath, 'hardlink', config.ignore )
+        result = ""
+        try:
+            result = subprocess.check_output('ZXPSignCmd -sign %s "%s" %s %s -tsa %s'
+                                             % (signPath, pkgFile,
+                                                config.certPath, config.password, timestampURL), shell=True)
+        except subprocess.CalledProcessError as procErr:
+            if (procErr.returncode == 1):
+                raise PanelError( "Signing package failed.  ZXPSignCmd is not installed?", procErr.returncode )
+            else:
+                raise PanelError( "Signing package %s failed." % (self.panelName + ".zip"), procErr.returncode )
+        else:
+            print( result )
+            config.getBuildCache().record( pkgFile, buildKey )
+        finally:
+            if signPath != self.srcPath():
+                removePath( signPath )
+
+    # Unpack the package made with -p into the install location
+    def installPackage(self):
+        pkgFile = self.packagePath()
+        print( "# Extracting %s \n   to %s" % (pkgFile, self.destPath()) )
+        self.deploy( lambda stagePath: extractPackage( pkgFile, stagePath ) )
+
+    #
+    # Make a delta package (see deltaFormat) from the earlier version of the
+    # panel in baseFolder to this one: from its package (<bundle ID>.zip, as
+    # in an earlier Targets folder) to the one made by -z or -p, or else from
+    # its source folder to this one.
+    #
+    def makeDelta(self, baseFolder):
+        config = self.config
+        basePath = os.path.join( baseFolder, self.fullPanelID + ".zip" )
+        if os.path.isfile( basePath ):
+            newPath = self.packagePath()
+            if not os.path.isfile( newPath ):
+                raise PanelError( "No package of %s to compare with %s, use -z or -p first" % (self.panelName, basePath) )
+        else:
+            basePath, newPath = os.path.join( baseFolder, self.panelSrcFolder ), self.srcPath()
+            if not os.path.isdir( basePath ):
+                raise PanelError( "No earlier version of %s in %s" % (self.panelName, baseFolder) )
+
+        buildPath = config.getTargetFolder() + self.fullPanelID + ".delta.zip"
+        delta = makeDelta( basePath, newPath, buildPath, config.ignore, config.zipLevel )
+        if not (delta['added'] or delta['changed'] or delta['deleted']):
+            os.remove( buildPath )
+            print( "# %s hasn't changed since %s" % (self.panelName, basePath) )
+            return
+        deltaPath = config.getTargetFolder() + "%s_%s-%s.delta.zip" % (self.fullPanelID, delta['baseVersion'],
+                                                                       delta['version'])
+        os.replace( buildPath, deltaPath )
+        print( "# Created delta %s: %d added, %d changed, %d deleted (%d bytes)"
+               % (deltaPath, len(delta['added']), len(delta['changed']), len(delta['deleted']),
+                  os.path.getsize( deltaPath )) )
+
+    # Make the zip of the panel source
+    def zipPanel(self):
+        config = self.config
+        zipTargetFile = self.packagePath()
+        buildKey = config.getBuildCache().buildKey( self.srcPath(), "zip", config.zipLevel, ignore=config.ignore )
+        if config.getBuildCache().isCurrent( zipTargetFile, buildKey ) and not config.rebuild:
+            print( "# Archive is up to date: " + zipTargetFile )
+            return
+        print( "# Creating archive: " + zipTargetFile )
+        with PanelZipWriter( zipTargetFile, config.zipLevel ) as zf:
+            zf.writeTree( self.srcPath(), config.ignore )
+        config.getBuildCache().record( zipTargetFile, buildKey )
+
+#
+# One panel source installed in several places at once: a Panel for each
+# destination (see fanOutPanels).  copyPanel reads each source file once
+# and writes it to all the staging folders, then swaps each one in.
+#
+class PanelTargets:
+    def __init__(self, panels):
+        self.panels = panels
+        self.panelName = panels[0].panelName
+
+    def srcPath(self):
+        return self.panels[0].srcPath()
+
+    def copyPanel(self):
+        linkMode = self.panels[0].config.linkMode
+        print( "# %s %s to %d destinations" % (linkVerbs[linkMode], self.srcPath(), len(self.panels)) )
+        stagePaths = []
+        try:
+            for p in self.panels:
+                stagePaths.append( p.newStage() )
+            if linkMode == 'copy':
+                copyTreeTo( self.srcPath(), stagePaths, self.panels[0].config.ignore )
+            else:
+                for stagePath in stagePaths:
+                    copyTree( self.srcPath(), stagePath, linkMode, self.panels[0].config.ignore )
+        except BaseException:
+            for stagePath in stagePaths:
+                if os.path.lexists( stagePath ):
+                    removePath( stagePath )
+            raise
+        for index, (p, stagePath) in enumerate( zip( self.panels, stagePaths ) ):
+            try:
+                p.swapIn( stagePath )
+            except BaseException:
+                for leftPath in stagePaths[index:]:
+                    if os.path.lexists( leftPath ):
+                        removePath( leftPath )
+                raise
+
+# For future reference, the Extension Manager stages the bundle in
+#
+# (Mac) /Library/Application Support/Adobe/Extension Manager CC/EM Store/Photoshop/
+# (Win) %APPDATA%\Adobe\Extension Manager CC\EM Store\Photoshop{32,64} (No?)
+# (Win) %APPDATA%\Adobe.ExMan\Local Store\Photoshop{32,64}    (No?)
+# (Win) C:\ProgramData\Adobe\Extension Manager CC\EM Store\Shared\   (YES?!)
+#
+# and deploys it to:
+#
+# (Mac) /Library/Application Support/Adobe/CEP/extensions/  (for all users)
+#       ~/Library/Application Support/Adobe/CEP/extensions/ (for current user)
+# (Win) C:\Program Files\Common Files\Adobe\CEP\extensions\  (for all users)
+# 		C:\<username>\AppData\Roaming\Adobe\CEP\extensions\  (for current user)
+# Note the Adobe CC Panel deploys them to:
+# (Win) C:\Program Files(x86)\Common Files\Adobe\CEP\extensions\[extensionID]
+#
+
+#
+# With several jobs, panels are worked on by several threads at once.  Anything
+# printed while working on a panel is collected per thread, then written
+# out in panel order so the output for each panel stays together.
+#
+class PanelOutput:
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr( self.local, 'buffer', None )
+        return (buffer if buffer is not None else self.stream).write( text )
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr( self.stream, name )
+
+outputLock = threading.Lock()
+
+# Route sys.stdout through a PanelOutput (once), so threads can capture what they print
+def panelOutput():
+    with outputLock:
+        if not isinstance( sys.stdout, PanelOutput ):
+            sys.stdout = PanelOutput( sys.stdout )
+        return sys.stdout
+
+# Call fn(*args) on this thread; returns its result and everything it printed
+def runCaptured(fn, *args):
+    output = panelOutput()
+    outerBuffer = getattr( output.local, 'buffer', None )
+    output.local.buffer = io.StringIO()
+    try:
+        return fn( *args ), output.local.buffer.getvalue()
+    finally:
+        output.local.buffer = outerBuffer
+
+#
+# Run action(panel) for each panel, using up to jobs threads.  The
+# per-panel steps spend their time in file I/O, zlib and ZXPSignCmd child
+# processes, so threads overlap them well.  Returns the exit status of the
+# first panel (in list order) that failed, or 0.
+#
+def runPanelJobs(action, panels, jobs=1, phase=None, measure=None, timings=None, ignore=()):
+    def runOne(panel):
+        try:
+            if phase and timings:
+                with timings.phase( phase, panel.panelName, measure( panel ) if measure else None, ignore ):
+                    action( panel )
+            else:
+                action( panel )
+            return 0
+        except PanelError as panelErr:
+            if str(panelErr):
+                print( "## %s" % panelErr )
+            return panelErr.status
+        except SystemExit as exitErr:
+            return exitErr.code if isinstance( exitErr.code, int ) else 1
+        except Exception:
+            traceback.print_exc( file=sys.stdout )
+            return 1
+
+    if jobs <= 1 or len(panels) <= 1:
+        for p in panels:
+            status = runOne( p )
+            if status:
+                return status
+        return 0
+
+    panelOutput()
+    with concurrent.futures.ThreadPoolExecutor( max_workers=jobs ) as pool:
+        results = [pool.submit( runCaptured, runOne, p ) for p in panels]
+        statuses = []
+        for r in results:
+            status, output = r.result()
+            # Goes to this thread's own capture buffer, if it has one
+            sys.stdout.write( output )
+            sys.stdout.flush()
+            statuses.append( status )
+    return next( (s for s in statuses if s), 0 )
+
+# Run the action on every panel, raising PanelError if any of them failed.
+# The phase name and measure(panel) (a path to count files and bytes in)
+# are for the timings.
+def forEachPanel(action, panels, config, phase=None, measure=None):
+    status = runPanelJobs( action, panels, config.jobs, phase, measure, config.timings, config.ignore )
+    if status:
+        raise PanelError( "", status )    # The panels' own errors were already printed
+
+def panelManifests(config):
+    return sorted( glob.glob( os.path.join( glob.escape( config.srcLocation ), "*", "CSXS", "manifest.xml" ) ) )
+
+#
+# Find installable extensions: each folder in config.srcLocation with a
+# CSXS/manifest.xml.
+#
+def discoverPanels(config):
+    with config.timings.phase( "manifest discovery" ) as record:
+        manifestFiles = panelManifests( config )
+        record['files'] = len(manifestFiles)
+        # Load the panel info from the extension
+        panels = [Panel(m, config) for m in map(config.manifestCache.load, manifestFiles) if m]
+        config.manifestCache.save()
+    return panels
+
+#
+# Pair up the panels from each source with each destination.  configs has
+# a PanelConfig for each (source, destination); each source's manifests
+# are only read once.  Returns a PanelTargets for each panel source.
+#
+def fanOutPanels(configs):
+    panelsBySource = {}
+    targets = collections.OrderedDict()
+    installedFrom = {}
+    for config in configs:
+        if config.srcLocation not in panelsBySource:
+            panelsBySource[config.srcLocation] = discoverPanels( config )
+        for p in panelsBySource[config.srcLocation]:
+            target = Panel( p.manifest, config )
+            destPath = os.path.normcase( target.destPath() )
+            if installedFrom.setdefault( destPath, p.srcPath() ) != p.srcPath():
+                raise PanelError( "%s would be installed from both %s and %s"
+                                  % (target.destPath(), installedFrom[destPath], p.srcPath()) )
+            targets.setdefault( p.srcPath(), [] ).append( target )
+    return [PanelTargets( panels ) for panels in targets.values()]
+
+def printFanOutPlan(panelTargets):
+    destinations = {p.config.destPath for t in panelTargets for p in t.panels}
+    print( "# %d panels, %d destinations:" % (len(panelTargets), len(destinations)) )
+    for t in panelTargets:
+        manifest = t.panels[0].manifest
+        print( "#   %s (%s %s)" % (t.srcPath(), manifest.bundleID, manifest.bundleVersion or "") )
+        for p in t.panels:
+            print( "#     -> " + p.destPath() )
+
+# (files, bytes) in the panel, and (files, bytes) left out by the ignore patterns
+def measurePanel(root, ignore):
+    kept, ignored = [0, 0], [0, 0]
+    def measureFolder(folder, ignoring):
+        for entry in os.scandir( folder ):
+            counts = ignored if (ignoring or isIgnored( entry.name, ignore )) else kept
+            if entry.is_dir():
+                measureFolder( entry.path, counts is ignored )
+            else:
+                counts[0] += 1
+                counts[1] += entry.stat().st_size
+    measureFolder( root, False )
+    return tuple(kept), tuple(ignored)
+
+#
+# Pre-flight check (--check) of the panels' manifests (see Panel.problems),
+# bundle IDs used by more than one panel, manifests that couldn't be read,
+# and each panel's size (less the ignored files) against the config's
+# budgets.  Panels are checked on a pool of threads.  Prints a report and
+# raises PanelError if anything's wrong.
+#
+def checkPanels(panels, config):
+    with config.timings.phase( "check", measurePath=config.srcLocation, ignore=config.ignore ):
+        def checkPanel(panel):
+            problems = panel.problems()
+            (files, size), (ignoredFiles, ignoredSize) = measurePanel( panel.srcPath(), config.ignore )
+            if config.fileBudget is not None and files > config.fileBudget:
+                problems.append( "%d files is over the budget of %d" % (files, config.fileBudget) )
+            if config.byteBudget is not None and size > config.byteBudget:
+                problems.append( "%.2f MB is over the budget of %.2f MB" % (size / 1e6, config.byteBudget / 1e6) )
+            return problems, files, size, ignoredFiles, ignoredSize
+
+        with concurrent.futures.ThreadPoolExecutor( max_workers=max( 4, config.jobs ) ) as pool:
+            results = list( pool.map( checkPanel, panels ) )
+
+        bundleFolders = collections.defaultdict( list )
+        for p in panels:
+            bundleFolders[p.manifest.bundleID].append( p.panelSrcFolder )
+        unreadable = set( panelManifests( config ) ) - {p.manifest.path for p in panels}
+
+    print( "# %-36s %6s %10s %s" % ("Panel", "Files", "MB", "Ignored") )
+    failed = len(unreadable)
+    for p, (problems, files, size, ignoredFiles, ignoredSize) in zip( panels, results ):
+        if len(bundleFolders[p.manifest.bundleID]) > 1:
+            problems.append( "ExtensionBundleId is also used by %s"
+                             % ", ".join( f for f in bundleFolders[p.manifest.bundleID] if f != p.panelSrcFolder ) )
+        ignoredText = "%d files, %.1f MB" % (ignoredFiles, ignoredSize / 1e6) if ignoredFiles else ""
+        print( "# %-36s %6d %10.1f %s" % (p.panelSrcFolder, files, size / 1e6, ignoredText) )
+        for problem in problems:
+            print( "##   %s" % problem )
+        failed += bool(problems)
+    for manifestPath in sorted( unreadable ):
+        print( "## %s can't be read" % manifestPath )
+
+    if failed:
+        raise PanelError( "%d of %d panels failed the check" % (failed, len(panels) + len(unreadable)) )
+    print( "# All %d panels passed the check" % len(panels) )
+
+# If writing to the system folders, make sure we actually can
+def checkDestWritable(destPath):
+    try:
+        if (not os.path.exists(destPath)):
+           os.makedirs(destPath)
+        testfile = destPath + os.sep + "test.txt"
+        with open( testfile, 'w') as f:
+            f.write("test")
+        os.remove(testfile)
+    except (OSError, IOError) as writeErr:
+        if (writeErr.errno == errno.EACCES):
+           raise PanelError( "Must run as admin to access %s" % destPath )
+        else:
+           raise PanelError( "Unable to access %s" % destPath )
+
+def erasePanels(panels, config):
+    # Unlock, then remove the panels
+    forEachPanel( Panel.erasePanel, panels, config, "erase", Panel.destPath )
+    clearExtensionCache(config)
+
+# The folder is moved aside and deleted in the background (see TrashBin)
+def clearExtensionCache(config):
+    cachePath = config.extensionCachePath()
+    if cachePath and os.path.exists(cachePath):
+        with config.timings.phase( "clear extension cache" ):
+            trash = TrashBin( cachePath + ".trash", max( 1, config.jobs ) )
+            trash.discard( cachePath )
+            trash.close()
+
+#
+# Remove the panels' CEP cache folders: those with a panel's ID anywhere in
+# their name.  The cache is scanned once, matching every panel ID at the
+# same time, and the matches go into a TrashBin.
+#
+def cleanCaches(panels, config):
+    cachePath = cepCachePath()
+    if not (cachePath and panels and os.path.isdir( cachePath )):
+        return
+    with config.timings.phase( "clean cache" ):
+        # Longest first, so an ID that's a prefix of another doesn't hide it
+        panelIDs = sorted( {p.fullPanelID for p in panels}, key=len, reverse=True )
+        panelPattern = re.compile( "|".join( re.escape( panelID ) for panelID in panelIDs ) )
+        trash = TrashBin( os.path.normpath( cachePath ) + ".trash", max( 4, config.jobs ) )
+        for entry in os.scandir( cachePath ):
+            if not panelPattern.search( entry.name ):
+                continue
+            try:
+                trash.discard( entry.path )
+                print( "# Removing cache folder " + entry.path )
+            except (OSError, IOError) as writeErr:
+                if (writeErr.errno == errno.EACCES):
+                    print( "# PS still running? Unable to delete " + entry.path )
+                else:
+                    print( "# Unable to remove cache folder " + entry.path )
+        files, size = trash.finish()
+        if files:
+            print( "# Reclaimed %.1f MB in %d files" % (size / 1e6, files) )
+
+#
+# List the panels in each extensions folder.  Manifests come from the
+# manifest cache, so only new or changed ones are parsed, and those are
+# parsed on a thread pool.
+#
+def listInstalledPanels(config, outputFormat='text', branch=None, stream=None, destOnly=False):
+    stream = stream or sys.stdout
+    # With destOnly, just config.destPath rather than every extension folder
+    destPaths = None if destOnly else defaultDestPaths()
+    if destPaths:
+        locations = [(destPaths[True], "for all users"),
+                     (destPaths[False], "for this user"),
+                     (psAppFolder() + "Required" + os.sep + "CEP" + os.sep + "extensions" + os.sep, "installed with Photoshop")]
+    else:
+        locations = [(config.destPath, "in %s" % config.destPath)]
+    # For Adobe developers, also list extensions found in the specified debug branch
+    if (branch and isAdobeDevMachine()):
+        locations.append( (branch + devExtensionPath(), "for branch %s debug app" % branch) )
+
+    def readPanel(panelPath):
+        # Fish the ID for each extension in the package out of the CSXS/manifest.xml file
+        panelManifest = os.path.join( panelPath, "CSXS", "manifest.xml" )
+        if not os.path.exists( panelManifest ):
+            return panelPath, panelManifest, None
+        return panelPath, panelManifest, config.manifestCache.load( panelManifest, report=False )
+
+    listing = []
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        for panelPath, title in locations:
+            if (not os.path.exists(panelPath)):
+                continue
+            panelDirs = sorted( glob.glob(panelPath + "*") )
+            if len(panelDirs) > 0:
+                listing.append( (title, os.path.dirname(panelDirs[0]), list( pool.map( readPanel, panelDirs ) )) )
+    config.manifestCache.prune( [folder for title, folder, panels in listing],
+                                [panelManifest for title, folder, panels in listing for p, panelManifest, m in panels] )
+    config.manifestCache.save()
+
+    if outputFormat == 'json':
+        def panelInfo(panelPath, panelManifest, manifest):
+            info = {'folder': os.path.basename(panelPath), 'path': panelPath}
+            if manifest:
+                info.update( manifest.cacheEntry() )
+            else:
+                info['error'] = "Manifest missing" if not os.path.exists( panelManifest ) else "No ExtensionManifest"
+            return info
+        print( json.dumps( [{'title': title, 'path': folder, 'panels': [panelInfo(*p) for p in panels]}
+                            for title, folder, panels in listing], indent=2 ), file=stream )
+        return
+
+    for title, folder, panels in listing:
+        print( "\n# (%s)\n# Panels in %s" % (title, folder), file=stream )
+        for panelPath, panelManifest, manifest in panels:
+            if not os.path.exists(panelManifest):
+                print( "## Manifest missing: %s" % panelManifest, file=stream )
+                continue
+            name = os.path.basename(panelPath)
+            manifest = [manifest] if manifest else []
+            # Only print the bundle (names) if they're different from the folder name
+            extNames = [x.bundleName for x in manifest if x.bundleName and x.bundleName != name]
+            extVersions = [x.bundleVersion for x in manifest if x.bundleVersion]
+            extNames = " (" + ",".join(extNames) + ")" if len(extNames) > 0 else ""
+            extVersions = " [" + ",".join(extVersions) + "]" if len(extVersions) > 0 else ""
+            print( "  %s%s%s" % (name, extVersions, extNames), file=stream )
+
+#
+# Examine the state of debugKey (either "Logging" or "PlayerDebugMode")
+# If panelDebugValue is not None, set the to that value.
+# returns the previous value of the debugKey
+#
+def panelExecutionState( debugKey, cepVersion, panelDebugValue=None ):
+    oldPanelDebugValue = 'err'
+    CEPversion = 'CSXS.' + cepVersion
+
+    # Windows: add HKEY_CURRENT_USER/Software/Adobe/CSXS.5 (add key) PlayerDebugMode [String] "1"
+    if sys.platform == 'win32':
+        import winreg
+        def tryKey(key):
+            try:
+                return winreg.QueryValueEx( key, debugKey )
+            except:
+                return None
+
+        access = winreg.KEY_READ if (not panelDebugValue) else winreg.KEY_ALL_ACCESS
+
+        ky = winreg.OpenKey( winreg.HKEY_CURRENT_USER,
+                              "Software\\Adobe\\%s" % CEPversion, 0, access )
+        keyValue = tryKey( ky )
+        oldPanelDebugValue = '1' if keyValue and (keyValue[0] == '1') else '0'
+
+        if (panelDebugValue):
+            if not keyValue:
+                winreg.CreateKey( ky, debugKey )
+            winreg.SetValueEx( ky, debugKey, 0, winreg.REG_SZ, panelDebugValue );
+
+        winreg.CloseKey( ky )
+
+    # Mac: ~/Library/Preferences/com.adobe.CSXS.5.plist (add row) PlayerDebugMode [String] "1"
+    elif sys.platform == "darwin":
+        import subprocess, plistlib, platform, re
+        plistFile = os.path.expanduser( "~/Library/Preferences/com.adobe.%s.plist" % CEPversion )
+
+        # First, make sure the Plist is in text format
+        subprocess.check_output( "plutil -convert xml1 " + plistFile, shell=True )
+        plist = plistlib.readPlist( plistFile )
+        oldPanelDebugValue = '1' if ((debugKey in plist) and (plist[debugKey] == '1')) else '0'
+
+        if (panelDebugValue):
+            plist[debugKey] = panelDebugValue
+            plistlib.writePlist( plist, plistFile )
+
+            # On Mac OS X 10.9 and higher, must reset the cfprefsd process
+            # before changes in a plist file take effect
+            macOSVer = [int(x) for x in platform.mac_ver()[0].split('.')]
+            if (macOSVer[0] == 10) and (macOSVer[1] >= 9):
+                proc = subprocess.Popen("ps ax | grep cfprefsd | grep -v grep", shell=True,
+                                        stdout=subprocess.PIPE).stdout.read()
+                procID = re.findall("^\s*(\d+)", proc.decode('utf-8'), re.MULTILINE)
+                if (procID):
+                    for p in procID:
+                        print( "# MacOS 10.9: Killing cfprefsd process ID: " + p )
+                    os.system( "kill -HUP " + p )
+                else:
+                    print( "# MacOS 10.9: No cfprefsd process" )
+
+    else:
+        raise PanelError( "Unsupported platform: " + sys.platform, 0 )
+
+    return oldPanelDebugValue
+
+# Whether PlayerDebugMode is on; always off where there's no Photoshop
+def debugModeEnabled(cepVersion):
+    if sys.platform not in ('win32', 'darwin'):
+        return False
+    return panelExecutionState( 'PlayerDebugMode', cepVersion ) == '1'
+
+#
+# Setup/remove remote debug config files
+#
+def setupRemoteDebugFiles(panels, config):
+    with config.timings.phase( "debug files" ):
+        debugEnabled = debugModeEnabled( config.cepVersion )
+        destConfigs = list( {id( p.config ): p.config for p in panels}.values() )
+        if debugEnabled:
+            # Extensions new to the ports file get ports in ID order, not folder order
+            for p in sorted( panels, key=lambda p: p.fullPanelID ):
+                for extName in sorted( p.manifest.extensionIDs ):
+                    p.config.getDebugPorts().portFor( extName )
+        for p in panels:
+            p.setupRemoteDebugFile(debugEnabled)
+        for c in destConfigs:
+            c.getDebugPorts().save()
+
+#
+# Mirror source changes into the debug location until interrupted.  Bursts
+# of changes (an editor saving several files, a git checkout) are collected
+# until there's a quiet period of debounceTime, then pushed together.
+#
+def watchPanels(panels, config, debounceTime=0.15):
+    debugEnabled = debugModeEnabled( config.cepVersion )
+    forEachPanel( Panel.syncPanel, panels, config )
+    setupRemoteDebugFiles( panels, config )
+
+    panelRoots = {os.path.normpath( p.srcPath() ) + os.sep: p for p in panels}
+    watcher = makeWatcher( [root for root in panelRoots] )
+    print( "# Watching %d panels with %s (Ctrl-C to stop)" % (len(panelRoots), type(watcher).__name__) )
+    try:
+        while True:
+            changed = watcher.changes()
+            while True:
+                more = watcher.changes( debounceTime )
+                if not more:
+                    break
+                changed |= more
+
+            changesByPanel = collections.defaultdict( set )
+            for path in changed:
+                for root, p in panelRoots.items():
+                    if path.startswith( root ):
+                        changesByPanel[p].add( path )
+            for p, paths in changesByPanel.items():
+                try:
+                    p.pushChanges( paths, debugEnabled )
+                except (OSError, IOError) as copyErr:
+                    # Often a file that's being saved; the next event will retry it
+                    print( "# Unable to update %s: %s" % (p.panelName, copyErr) )
+    except KeyboardInterrupt:
+        print()
+
+#
+# Serves jobs sent as JSON lines, one object per line, e.g.
+#
+#   {"id": 7, "op": "sync", "src": "/work/panels", "dest": "/tmp/ext", "jobs": 4}
+#
+# op is one of PanelServer.operations; the other keys are optional and
+# match the PanelConfig arguments (src defaults to the server's source
+# folder), plus "panels" (bundle IDs or folder names to limit the job to),
+# "hash" (for sync) and "debug" (also write the .debug files).  Each job
+# gets back one line with its id, exit status, output and time taken, as
+# soon as it finishes.
+#
+# Between jobs the server keeps the parsed manifests, the build indexes
+# and, for sync, a snapshot of each panel source as it was last copied to
+# each destination, so a sync only pushes the files changed since then.
+# Jobs run concurrently, but jobs writing the same destination (or, for zip
+# and package, the same Targets folder) take turns.
+#
+class PanelServer:
+    operations = ('install', 'sync', 'extract', 'zip', 'package', 'erase', 'clean', 'rollback')
+
+    def __init__(self, srcLocation, workers=1):
+        self.srcLocation = srcLocation
+        self.pool = concurrent.futures.ThreadPoolExecutor( max_workers=max( 1, workers ) )
+        self.lock = threading.Lock()
+        self.pathLocks = {}
+        self.manifestCaches = {}
+        self.buildCaches = {}
+        self.snapshots = {}
+
+    def lockFor(self, path):
+        with self.lock:
+            return self.pathLocks.setdefault( os.path.normcase( os.path.normpath( path ) ), threading.Lock() )
+
+    def makeConfig(self, job):
+        srcLocation = os.path.abspath( job.get('src', self.srcLocation) )
+        targetFolder = os.path.abspath( job.get('targets') or os.path.join( srcLocation, "Targets" ) )
+        with self.lock:
+            if targetFolder not in self.manifestCaches:
+                self.manifestCaches[targetFolder] = ManifestCache( os.path.join( targetFolder, "manifestCache.json" ) )
+            manifestCache = self.manifestCaches[targetFolder]
+        config = PanelConfig( srcLocation, job.get('dest'), job.get('allusers', False), job.get('cepVersion', '10'),
+                              job.get('jobs', 1), job.get('zipLevel', 6), job.get('rebuild', False),
+                              job.get('password'), job.get('cert'), targetFolder, manifestCache,
+                              linkMode=job.get('linkMode', 'copy'), ignore=job.get('ignore', defaultIgnore) )
+        with self.lock:
+            if targetFolder not in self.buildCaches:
+                self.buildCaches[targetFolder] = BuildCache( config.getTargetFolder() )
+            config.buildCache = self.buildCaches[targetFolder]
+        return config
+
+    # Copy just what changed since the last sync to the same place
+    def syncPanel(self, panel, useHash=False):
+        key = (panel.srcPath(), panel.destPath())
+        snapshot = scanTree( [panel.srcPath()] )
+        with self.lock:
+            lastSynced = self.snapshots.get( key )
+        if lastSynced is not None and os.path.isdir( panel.destPath() ):
+            changed = changedPaths( lastSynced, snapshot )
+            if changed:
+                panel.pushChanges( changed )
+            else:
+                print( "# %s is up to date" % panel.destPath() )
+        else:
+            panel.syncPanel( useHash )
+        with self.lock:
+            self.snapshots[key] = snapshot
+
+    def forgetSnapshots(self, panels):
+        with self.lock:
+            for p in panels:
+                self.snapshots.pop( (p.srcPath(), p.destPath()), None )
+
+    def runOperation(self, op, config, job):
+        panels = discoverPanels( config )
+        if job.get('panels'):
+            panels = [p for p in panels if p.fullPanelID in job['panels'] or p.panelSrcFolder in job['panels']]
+        try:
+            if op in ('install', 'extract', 'erase', 'rollback'):
+                self.forgetSnapshots( panels )
+            if op == 'install':
+                clearExtensionCache( config )
+                forEachPanel( Panel.copyPanel, panels, config )
+            elif op == 'sync':
+                forEachPanel( lambda p: self.syncPanel( p, job.get('hash', False) ), panels, config )
+            elif op == 'extract':
+                forEachPanel( Panel.installPackage, [p for p in panels if os.path.exists( p.packagePath() )], config )
+            elif op == 'erase':
+                erasePanels( panels, config )
+            elif op == 'clean':
+                cleanCaches( panels, config )
+            elif op == 'rollback':
+                forEachPanel( Panel.rollback, panels, config )
+                clearExtensionCache( config )
+            else:
+                try:
+                    forEachPanel( Panel.zipPanel if op == 'zip' else Panel.packagePanel, panels, config )
+                finally:
+                    config.getBuildCache().save()
+            if job.get('debug'):
+                setupRemoteDebugFiles( panels, config )
+        except PanelError as err:
+            if str(err):
+                print( "## %s" % err )
+            return err.status
+        finally:
+            config.manifestCache.save()
+        return 0
+
+    def runJob(self, job):
+        started = time.perf_counter()
+        op = job.get('op')
+        try:
+            if op not in self.operations:
+                raise PanelError( "Unknown op %r, expected one of %s" % (op, ", ".join( self.operations )), 2 )
+            config = self.makeConfig( job )
+            with self.lockFor( config.targetFolder if op in ('zip', 'package') else config.destPath ):
+                status, output = runCaptured( self.runOperation, op, config, job )
+        except PanelError as err:
+            status, output = err.status, "## %s\n" % err
+        except Exception:
+            status, output = 1, traceback.format_exc()
+        return {'id': job.get('id'), 'op': op, 'status': status, 'output': output,
+                'seconds': round( time.perf_counter() - started, 4 )}
+
+    # Read jobs from inStream until it ends, writing each result to outStream
+    def serveStream(self, inStream, outStream):
+        writeLock = threading.Lock()
+        def reply(result):
+            with writeLock:
+                outStream.write( json.dumps( result ) + "\n" )
+                outStream.flush()
+
+        pending = []
+        for line in inStream:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads( line )
+                if not isinstance( job, dict ):
+                    raise ValueError( "a job must be a JSON object" )
+            except ValueError as jobErr:
+                reply( {'id': None, 'op': None, 'status': 2, 'output': "## Bad job: %s\n" % jobErr, 'seconds': 0} )
+                continue
+            pending.append( self.pool.submit( lambda job: reply( self.runJob( job ) ), job ) )
+        concurrent.futures.wait( pending )
+
+    # Accept connections on a Unix socket; each one is served like a stream
+    def serveSocket(self, socketPath):
+        import socketserver
+        panelServer = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                panelServer.serveStream( io.TextIOWrapper( self.rfile, encoding='utf-8' ),
+                                         io.TextIOWrapper( self.wfile, encoding='utf-8', write_through=True ) )
+
+        # A socket left by a server that's gone can be replaced, but not a
+        # running server's socket or anything that isn't a socket
+        if os.path.lexists( socketPath ):
+            if not stat.S_ISSOCK( os.lstat( socketPath ).st_mode ):
+                raise PanelError( "%s exists and isn't a socket" % socketPath )
+            import socket
+            with socket.socket( socket.AF_UNIX, socket.SOCK_STREAM ) as probe:
+                try:
+                    probe.connect( socketPath )
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.remove( socketPath )
+                else:
+                    raise PanelError( "A server is already running on %s" % socketPath )
+        with socketserver.ThreadingUnixStreamServer( socketPath, JobHandler ) as unixServer:
+            print( "# Serving panel jobs on %s (Ctrl-C to stop)" % socketPath )
+            sys.stdout.flush()
+            try:
+                unixServer.serve_forever()
+            except KeyboardInterrupt:
+                print()
+            finally:
+                os.remove( socketPath )